@@ -0,0 +1,271 @@
+"""Times how fast each iteration's StateMachine.do_event runs.
+
+Run it from this directory:
+    python benchmark.py
+
+Every iteration names its file statemachine.py, so a plain import would only
+ever find the one in the current folder. load_statemachine loads each file
+under its own module name instead so all three can be compared side by side."""
+import importlib.util
+import os
+import random
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+ITERATIONS = ['iter1', 'iter2', 'iter3']
+
+def load_statemachine(iteration, name='StateMachine'):
+    path = os.path.join(ROOT, iteration, 'statemachine.py')
+    spec = importlib.util.spec_from_file_location(
+        iteration + '_statemachine', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, name)
+
+"""A list of (event_type, event_param) pairs. Mostly keypresses with the
+odd timeout thrown in so every branch of do_event gets used."""
+def make_events(count, seed=0):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            events.append((0, None))
+        else:
+            events.append((1, rng.choice('0123456789')))
+    return events
+
+def replay(machine, events):
+    do_event = machine.do_event
+    for event_type, event_param in events:
+        do_event(event_type, event_param)
+
+def main(count=100000, repeat=5):
+    events = make_events(count)
+    classes = [load_statemachine(name) for name in ITERATIONS]
+
+    for name, cls in zip(ITERATIONS, classes):
+        machine = cls()
+        best = min(timeit.repeat(lambda: replay(machine, events),
+                                 number=1, repeat=repeat))
+        report(name, best, count)
+
+    compact = load_statemachine('iter3', 'CompactStateMachine')
+    machine = compact()
+    best = min(timeit.repeat(lambda: replay(machine, events),
+                             number=1, repeat=repeat))
+    report('iter3 compact', best, count)
+
+    hashed = load_statemachine('iter3', 'HashedStateMachine')
+    machine = hashed()
+    best = min(timeit.repeat(lambda: replay(machine, events),
+                             number=1, repeat=repeat))
+    report('iter3 hashed', best, count)
+    bench_compare()
+
+    from specmachine import GeneratedStateMachine
+    machine = GeneratedStateMachine()
+    best = min(timeit.repeat(lambda: replay(machine, events),
+                             number=1, repeat=repeat))
+    report('iter3 generated', best, count)
+
+    from codemachine import CodeMachine
+    for length in (4, 8):
+        machine = CodeMachine('12345678'[:length])
+        best = min(timeit.repeat(lambda: replay(machine, events),
+                                 number=1, repeat=repeat))
+        report('iter3 %d digit code' % length, best, count)
+
+    bench_multicode(events)
+
+    bench_tracing(classes[-1], events, repeat)
+
+    cls = classes[-1]
+    machine = cls()
+    best = min(timeit.repeat(lambda: machine.do_events(events),
+                             number=1, repeat=repeat))
+    report('iter3 do_events', best, count)
+
+    bench_lockbank(cls)
+    bench_lockout(cls, events)
+    bench_durable(events)
+    bench_controller(cls, events)
+    bench_ui(events)
+
+"""Machines without a Tracer attached should be exactly as fast as before,
+even while other machines in the same program are being traced. With a
+Tracer attached a machine is allowed to be slower."""
+def bench_tracing(cls, events, repeat):
+    from tracing import Tracer
+    tracer = Tracer()
+    traced = cls()
+    tracer.attach(traced)
+    best = min(timeit.repeat(lambda: replay(traced, events),
+                             number=1, repeat=repeat))
+    report('iter3 traced', best, len(events))
+
+    machine = cls()
+    best = min(timeit.repeat(lambda: replay(machine, events),
+                             number=1, repeat=repeat))
+    report('iter3 not traced', best, len(events))
+
+"""Times MultiCodeMachine with small and very large sets of 7 digit
+codes. The keys are random, so nearly every code is wrong, which is the
+case brute force guessing creates."""
+def bench_multicode(events, sizes=(10, 10000, 1000000), seed=2):
+    from multicode import CodeIndex, MultiCodeMachine
+    rng = random.Random(seed)
+    keypresses = [(1, rng.choice('0123456789')) for _ in range(len(events))]
+    for size in sizes:
+        codes = dict((user, '%07d' % code) for user, code in
+                     enumerate(rng.sample(range(10 ** 7), size)))
+        machine = MultiCodeMachine(CodeIndex(codes))
+        best = min(timeit.repeat(lambda: replay(machine, keypresses),
+                                 number=1, repeat=3))
+        report('iter3 %d codes' % size, best, len(keypresses))
+
+def bench_lockbank(cls, locks=100000, columns=50):
+    try:
+        import numpy as np
+        from lockbank import LockBank
+    except ImportError:
+        print("NumPy is not installed, skipping LockBank")
+        return
+    rng = np.random.default_rng(0)
+    params = rng.choice(np.frombuffer(b'0123456789', dtype=np.uint8),
+                        (columns, locks))
+    bank = LockBank(locks)
+    def run():
+        for column in params:
+            bank.apply(cls.E_KEYPRESS, column)
+    best = min(timeit.repeat(run, number=1, repeat=3))
+    report('iter3 LockBank', best, locks * columns)
+
+"""Times comparing an entered code with == and with compare_digest, for a
+code that is wrong in its first digit and one that is wrong in its last.
+== gets its answer sooner for the first, compare_digest takes the same time
+for both. With only 4 bytes the difference is tiny, so this also uses 4096
+byte codes, where it is easy to see."""
+def bench_compare(number=1000000):
+    for length in (4, 4096):
+        correct = b'1' * length
+        first = bytearray(b'2' + correct[1:])
+        last = bytearray(correct[:-1] + b'2')
+        for name, setup in (('==', 'compare = operator.eq'),
+                            ('compare_digest', 'from hmac import compare_digest as compare')):
+            times = []
+            for entered in (first, last):
+                timer = timeit.Timer('compare(entered, correct)', 'import operator; ' + setup,
+                                     globals={'entered': entered, 'correct': correct})
+                times.append(min(timer.repeat(3, number)) / number * 1e9)
+            print("    %4d bytes %-14s first wrong %7.1f ns  last wrong %7.1f ns"
+                  % (length, name, times[0], times[1]))
+
+"""Times a brute force attack on many keypads, with every key going to do_event, and
+with the front end dropping keys for locked out keypads first."""
+def bench_lockout(cls, events, locks=1000, keys=200000, seed=3):
+    from lockout import LockoutBoard, LockoutStateMachine
+    rng = random.Random(seed)
+    attack = [(rng.randrange(locks), rng.choice('0123456789'))
+              for _ in range(keys)]
+    now = [0.0]
+    clock = lambda: now[0]
+    def run(drop):
+        board = LockoutBoard(locks, attempts=3, delay=1.0)
+        machines = [LockoutStateMachine(board, i, clock) for i in range(locks)]
+        is_locked = board.is_locked
+        for step, (lock, key) in enumerate(attack):
+            #A key every millisecond.
+            now[0] = step * 0.001
+            if drop and is_locked(lock, now[0]):
+                continue
+            machines[lock].do_event(cls.E_KEYPRESS, key)
+    for drop, name in ((False, 'iter3 lockout'), (True, 'iter3 lockout drop')):
+        best = min(timeit.repeat(lambda: run(drop), number=1, repeat=3))
+        report(name, best, keys)
+
+"""Times DurableLocks committing every event on its
+own against committing them in groups."""
+def bench_durable(events, count=20000):
+    import shutil
+    import tempfile
+    from durable import DurableLocks
+
+    events = events[:count]
+    for group, sync in ((1, True), (64, True), (4096, True), (4096, False)):
+        work = tempfile.mkdtemp()
+        try:
+            def run():
+                with DurableLocks(work, group=group, sync=sync) as durable:
+                    for number, (event_type, event_param) in enumerate(events):
+                        durable.do_event(number % 1000, event_type, event_param)
+            best = min(timeit.repeat(run, number=1, repeat=3))
+        finally:
+            shutil.rmtree(work)
+        report('durable %d%s' % (group, '' if sync else ' nosync'), best, len(events))
+
+"""Times a Controller with children keypads, every event going to a random
+one of them, and shows how much memory a keypad takes there and as its
+own CompactStateMachine."""
+def bench_controller(cls, events, children=100000, seed=6):
+    import tracemalloc
+    from controller import Controller, DoorMachine
+    from statemachine import CompactStateMachine
+
+    rng = random.Random(seed)
+    routed = [(rng.randrange(children), event_type, event_param)
+              for event_type, event_param in events]
+    tracemalloc.start()
+    controller = Controller(DoorMachine(), children)
+    packed = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    objects = dict((child_id, CompactStateMachine()) for child_id in range(children))
+    separate = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+
+    def run():
+        do_event = controller.do_event
+        for child_id, event_type, event_param in routed:
+            do_event(child_id, event_type, event_param)
+    best = min(timeit.repeat(run, number=1, repeat=3))
+    report('iter3 controller', best, len(routed))
+    print("    bytes per keypad: controller %.1f, CompactStateMachine %.1f"
+          % (packed / float(children), separate / float(children)))
+
+"""Times the whole keypress -> state machine -> screen path of ComboLock,
+with a MemoryBackend standing in for the terminal, and prints how many
+window calls drawing took per keypress."""
+def bench_ui(events, keys=20000):
+    from combolock import ComboLock
+    from display import MemoryBackend
+    keypresses = [param for event_type, param in events[:keys] if event_type == 1]
+    #The -1s make every key arrive on its own, like somebody typing.
+    typed = [key for param in keypresses for key in (param, -1)]
+
+    def run():
+        backend = MemoryBackend(typed)
+        ComboLock(backend).run()
+        return backend.window.calls
+    best = min(timeit.repeat(run, number=1, repeat=3))
+    report('iter3 ComboLock UI', best, len(keypresses))
+
+    calls = run()
+    print("    per keypress: " + ", ".join(
+        "%s %.2f" % (name, calls[name] / float(len(keypresses)))
+        for name in sorted(calls)))
+
+    #The same keys all arriving at once, like pasted text. They are all
+    #handled and then drawn once.
+    best = min(timeit.repeat(lambda: ComboLock(MemoryBackend(keypresses)).run(),
+                             number=1, repeat=3))
+    report('iter3 ComboLock paste', best, len(keypresses))
+
+def report(name, seconds, count):
+    print("%-18s %8.0f ns/event %12.0f events/sec"
+          % (name, seconds / count * 1e9, count / seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""A repeatable benchmark of every iteration, with results saved as JSON.
+
+    python benchsuite.py --output results.json
+runs every workload below through iter1, iter2 and iter3's do_event, and
+through iter2 and iter3's ComboLock with a pretend terminal, and writes
+    events_per_sec     how many events per second
+    p50_ns, p99_ns     how long one event took, for the middle event and for
+                       the event slower than 99% of the others
+    net_blocks_per_event
+                       memory blocks still allocated afterwards, per event
+    peak_bytes_per_event
+                       the most extra memory in use at once, per event
+for each of them. iter1's ComboLock is one big function tied to curses, so
+it can't be run without a terminal and is left out.
+
+    python benchsuite.py --baseline results.json --threshold 0.10
+runs everything again and fails (exit code 1) if anything got more than
+10% slower than in results.json. Saving results before a change and
+checking against them after is how to find out if the change made things
+slower."""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+from benchmark import ROOT, load_statemachine
+from display import MemoryBackend, MemoryWindow
+
+ITERATIONS = ['iter1', 'iter2', 'iter3']
+
+E_TIMEOUT = 0
+E_KEYPRESS = 1
+
+def keys(text):
+    return [(E_KEYPRESS, c) for c in text]
+
+"""The event streams. Every code is followed by one more key, because a
+finished code needs a keypress to get back to IDLE."""
+def make_workloads(count, seed=0):
+    rng = random.Random(seed)
+    timeout_heavy = []
+    while len(timeout_heavy) < count:
+        timeout_heavy += keys('123'[:rng.randrange(1, 4)]) + [(E_TIMEOUT, None)]
+
+    random_keys = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            random_keys.append((E_TIMEOUT, None))
+        else:
+            random_keys.append((E_KEYPRESS, rng.choice('0123456789')))
+
+    return {
+        'all_correct': (keys('12340') * (count // 5 + 1))[:count],
+        'all_wrong': (keys('99990') * (count // 5 + 1))[:count],
+        'timeout_heavy': timeout_heavy[:count],
+        'random': random_keys,
+        }
+
+"""Events per second, and the 50th and 99th percentile time of a single
+event. Single events are too quick to time one by one accurately, so the
+percentiles include the cost of reading the clock. They are still fine for
+comparing runs on the same computer."""
+def time_events(make_machine, events, repeat):
+    def run():
+        do_event = make_machine().do_event
+        for event_type, event_param in events:
+            do_event(event_type, event_param)
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+
+    clock = time.perf_counter_ns
+    do_event = make_machine().do_event
+    samples = []
+    for event_type, event_param in events:
+        start = clock()
+        do_event(event_type, event_param)
+        samples.append(clock() - start)
+    samples.sort()
+    return {
+        'events_per_sec': len(events) / best,
+        'p50_ns': samples[len(samples) // 2],
+        'p99_ns': samples[len(samples) * 99 // 100],
+        }
+
+"""Python has no counter of every allocation it makes. What can be
+measured is how many more memory blocks exist after the events than
+before (memory that was kept), and with tracemalloc the most extra
+memory that was in use at any one time."""
+def measure_memory(make_machine, events):
+    machine = make_machine()
+    do_event = machine.do_event
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    for event_type, event_param in events:
+        do_event(event_type, event_param)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    kept = sys.getallocatedblocks() - blocks
+    return {
+        'net_blocks_per_event': kept / float(len(events)),
+        'peak_bytes_per_event': peak / float(len(events)),
+        }
+
+"""Loads an iteration's combolock.py. It does 'from statemachine import
+StateMachine', so for the length of the import 'statemachine' has to mean
+that iteration's file and not this folder's."""
+def load_combolock(iteration):
+    import importlib.util
+    folder = os.path.join(ROOT, iteration)
+    saved = sys.modules.pop('statemachine', None)
+    sys.path.insert(0, folder)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            iteration + '_combolock', os.path.join(folder, 'combolock.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(folder)
+        sys.modules.pop('statemachine', None)
+        if saved is not None:
+            sys.modules['statemachine'] = saved
+    return module.ComboLock
+
+class TimedWindow(MemoryWindow):
+    """A MemoryWindow that notes the time of every getch, so the time
+    between two getch calls is how long one keypress took to handle and
+    draw."""
+    def getch(self):
+        self.times.append(time.perf_counter_ns())
+        return MemoryWindow.getch(self)
+
+"""Runs a ComboLock with a TimedWindow in place of curses. iter3's
+ComboLock takes a backend for that. iter2's asks for its window in
+init_curses, so there init_curses and cleanup_curses are replaced on the
+instance instead."""
+def time_ui(combolock_class, keypresses, repeat, has_backend):
+    if has_backend:
+        #iter3 reads every waiting key at once, so the -1s are needed to
+        #make each key arrive on its own, like somebody typing. iter2
+        #can't handle -1 at all.
+        keypresses = [key for c in keypresses for key in (c, -1)]
+
+    def run():
+        window = TimedWindow(20, 40, keypresses)
+        window.times = []
+        if has_backend:
+            backend = MemoryBackend()
+            backend.window = window
+            combo = combolock_class(backend)
+        else:
+            combo = combolock_class()
+            combo.init_curses = lambda: setattr(combo, 'win', window)
+            combo.cleanup_curses = lambda: None
+        combo.run()
+        return window
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    times = run().times
+    if has_backend:
+        #Only the getch calls that returned a key start a new keypress.
+        times = times[0::2]
+    samples = sorted(b - a for a, b in zip(times, times[1:]))
+    return {
+        'events_per_sec': len(times) / best,
+        'p50_ns': samples[len(samples) // 2],
+        'p99_ns': samples[len(samples) * 99 // 100],
+        }
+
+def run_suite(count=100000, repeat=5, ui_keys=5000):
+    results = {}
+    for name, events in sorted(make_workloads(count).items()):
+        for iteration in ITERATIONS:
+            cls = load_statemachine(iteration)
+            result = time_events(cls, events, repeat)
+            result.update(measure_memory(cls, events[:count // 10]))
+            results['%s/do_event/%s' % (iteration, name)] = result
+
+    keypresses = [c for event_type, c in make_workloads(ui_keys)['random']
+                  if event_type == E_KEYPRESS]
+    for iteration in ['iter2', 'iter3']:
+        results['%s/ui/random' % iteration] = time_ui(
+            load_combolock(iteration), keypresses, 3, iteration == 'iter3')
+    return results
+
+"""Returns a list of everything in results that has fewer events_per_sec
+than (1 - threshold) times what baseline had."""
+def regressions(results, baseline, threshold):
+    slower = []
+    for name, old in sorted(baseline.items()):
+        new = results.get(name)
+        if new is None:
+            continue
+        if new['events_per_sec'] < old['events_per_sec'] * (1 - threshold):
+            slower.append("%s: %.0f -> %.0f events/sec"
+                          % (name, old['events_per_sec'], new['events_per_sec']))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run_suite(args.events, args.repeat)
+    for name in sorted(results):
+        result = results[name]
+        print("%-28s %12.0f events/sec  p50 %6d ns  p99 %6d ns"
+              % (name, result['events_per_sec'], result['p50_ns'], result['p99_ns']))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            slower = regressions(results, json.load(baseline), args.threshold)
+        for line in slower:
+            print("SLOWER " + line)
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
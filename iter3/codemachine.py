@@ -0,0 +1,80 @@
+from statemachine import BaseStateMachine
+
+class CodeMachine(BaseStateMachine):
+    """A combo lock for codes of any length.
+
+    StateMachine needs a state per digit (ONEDIGIT, TWODIGIT, THREEDIGIT), so
+    a 6 digit code would mean two more states and two more _transition
+    functions. Here all of those are one state, ENTERING, and a counter of
+    how many keys have been entered.
+
+    It also doesn't keep the keys. Every key is compared with the key at the
+    same place in the correct code as soon as it arrives, and matching
+    remembers whether every key so far was right. When the last key arrives
+    the answer is already known. So each key costs the same no matter how
+    long the code is, and a machine uses the same memory for a 4 digit code
+    as for a 40 digit one.
+
+    alphabet is the keys that count as part of a code, like '0123456789'.
+    Other keys are ignored while a code is being entered. None allows any
+    key."""
+    STATE_NAMES = [
+        'IDLE',
+        'ENTERING',
+        'CODEOK',
+        'CODEBAD',
+        ]
+
+    IDLE = 0
+    ENTERING = 1
+    CODEOK = 2
+    CODEBAD = 3
+
+    TRANSITIONS = {
+        (IDLE, BaseStateMachine.E_KEYPRESS): '_transition_ENTER',
+
+        (ENTERING, BaseStateMachine.E_KEYPRESS): '_transition_ENTER',
+        (ENTERING, BaseStateMachine.E_TIMEOUT): '_transition_IDLE',
+
+        (CODEOK, BaseStateMachine.E_KEYPRESS): '_transition_IDLE',
+
+        (CODEBAD, BaseStateMachine.E_KEYPRESS): '_transition_IDLE',
+        }
+
+    def __init__(self, correct_code='1234', alphabet=None):
+        if not correct_code:
+            raise ValueError("the code needs at least one key")
+        if alphabet is not None:
+            alphabet = frozenset(alphabet)
+            if not alphabet.issuperset(correct_code):
+                raise ValueError("the code uses keys that are not in the alphabet")
+        self._build_table()
+        self.correct_code = correct_code
+        self.code_length = len(correct_code)
+        self.alphabet = alphabet
+        self._transition_IDLE()
+
+    def _transition_IDLE(self, keycode=None):
+        self.state = self.IDLE
+        self.count = 0
+        self.matching = True
+
+    def _transition_ENTER(self, keycode):
+        if self.alphabet is not None and keycode not in self.alphabet:
+            return
+        if keycode != self.correct_code[self.count]:
+            self.matching = False
+        self.count += 1
+        if self.count < self.code_length:
+            self.state = self.ENTERING
+        elif self.matching:
+            self.state = self.CODEOK
+        else:
+            self.state = self.CODEBAD
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
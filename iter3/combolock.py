@@ -0,0 +1,188 @@
+from statemachine import StateMachine
+from timerwheel import TimeoutDriver
+from view import ScreenView
+from display import CursesBackend
+
+import time
+
+class ComboLock(object):
+
+    """How many seconds without a keypress before a half entered code is
+    cleared, and how often (in milliseconds) getch gives up waiting for a
+    key so we can check whether that time has passed."""
+    TIMEOUT = 5.0
+    POLL_MS = 100
+
+    """iter2 explains most of this file. The new parts are the
+    TimeoutDriver, which every keypress now goes through so it can start,
+    move or cancel the timeout timer, and the backend.
+
+    The backend (see display.py) is where we draw and get keys from. By
+    default it is the terminal through curses, like before. Passing in a
+    MemoryBackend instead runs the same program with no terminal at all:
+        ComboLock(MemoryBackend('12345')).run()
+
+    clock is where the time for timeouts comes from. A test can pass one
+    it moves forward itself instead of waiting TIMEOUT seconds."""
+    def __init__(self, backend=None, clock=time.monotonic):
+        #Create the State Machine instance
+        self._sm = StateMachine()
+        self._clock = clock
+        self._timeouts = TimeoutDriver(self.TIMEOUT, now=clock())
+        self._timeouts.add(0, self._sm)
+
+        self._backend = backend or CursesBackend()
+        #Every CODEOK and CODEBAD reached, as (time, state). See _handle_keys.
+        self.results = []
+        self.win = None
+        self._view = None
+
+    """All the curses setup moved into CursesBackend.start."""
+    def init_curses(self):
+        self.win = self._backend.start()
+        #In iter2 getch waited forever for a key, so nothing could happen
+        #while nobody was typing. Now getch gives up after POLL_MS and
+        #returns -1, which gives us a chance to fire timeouts.
+        #http://docs.python.org/2/library/curses.html#curses.window.timeout
+        self.win.timeout(self.POLL_MS)
+        self._view = ScreenView(self.win)
+
+    """If you do not clean up curses before the program ends
+    The terminal will act super weird and be hard to use."""
+    def cleanup_curses(self):
+        self._backend.stop()
+
+    """Builds the frame: what every line of the window should say right
+    now, as row -> (column, text). Nothing is drawn here. That is the
+    ScreenView's job.
+
+    This is the first option iter2's run function talks about for getting
+    the old state to the display: it is passed in as an argument, so the
+    OLD STATE line is just another line of the frame."""
+    def _frame(self, old_state=None):
+        if self._sm.state == StateMachine.CODEOK:
+            title = "SUCCESS"
+        elif self._sm.state == StateMachine.CODEBAD:
+            title = "NO!"
+        else:
+            title = "CODE:"
+
+        frame = {
+            1: (7, title),
+            2: (7, '* '*len(self._sm.cur_code)),
+            11: (7, "Curr PIN: "+" ".join(self._sm.cur_code)),
+            13: (7, "Correct PIN: "+" ".join(self._sm.correct_code)),
+            16: (7, "NEW STATE: %s"%StateMachine.STATE_NAMES[self._sm.state]),
+            18: (7, "Press q or CTRL-c to quit."),
+            }
+        if old_state is not None:
+            frame[15] = (7, "OLD STATE: %s"%StateMachine.STATE_NAMES[old_state])
+        return frame
+
+    """iter2 erased and redrew the whole window for every key, then
+    refreshed it, and run refreshed it a second time after adding the old
+    state. Now the view only writes the characters that changed and the
+    terminal is updated once, by doupdate."""
+    def _display_UI(self, old_state=None):
+        self._view.draw(self._frame(old_state))
+        self._backend.update()
+
+    """Fires the timeout if it is due. Returns True if it did, which means the
+    screen needs to be redrawn."""
+    def _check_timeout(self):
+        return bool(self._timeouts.expire(self._clock()))
+
+    """Waits for a key like before, but then also takes every other key that
+    is already waiting, and returns them all as a list of one character
+    strings. An empty list means getch gave up waiting.
+
+    When keys arrive faster than we can draw (pasting a code, or a slow
+    connection catching up), iter2 would draw every key one after another.
+    Reading them all first means they can all be handled and then drawn
+    once. timeout(0) makes getch return -1 straight away instead of
+    waiting when there are no more keys. We stop at 'q' because nothing
+    after it will be used."""
+    def _read_keys(self):
+        key = self.win.getch()
+        if key == -1:
+            return []
+        keys = [chr(key)]
+        self.win.timeout(0)
+        while keys[-1] != 'q':
+            key = self.win.getch()
+            if key == -1:
+                break
+            keys.append(chr(key))
+        self.win.timeout(self.POLL_MS)
+        return keys
+
+    """Sends every key before a 'q' to the state machine. Only the last
+    state gets drawn, so any CODEOK or CODEBAD reached along the way is
+    added to results as (time, state), so it isn't lost.
+
+    Returns the state before the last key that changed anything (None if
+    no key did), and whether a 'q' was pressed."""
+    def _handle_keys(self, keys):
+        old_state = None
+        for c in keys:
+            #if you press q, terminate the program.
+            if c == 'q':
+                return old_state, True
+            #Arrow and function keys come from getch as numbers above 255,
+            #and chr of some of those is a letter. The machine only takes
+            #keys that fit in one byte.
+            if c < '\u0100' and c.isalnum():
+                old_state = self._sm.state
+                now = self._clock()
+                self._timeouts.do_event(0, StateMachine.E_KEYPRESS, c, now)
+                if self._sm.state in (StateMachine.CODEOK, StateMachine.CODEBAD):
+                    self.results.append((now, self._sm.state))
+        return old_state, False
+
+    def run(self):
+        self.init_curses()
+        self._display_UI()
+
+        while True:
+            keys = self._read_keys()
+
+            #getch gave up waiting. Nobody is typing, so this is when a
+            #timeout can happen.
+            if not keys:
+                old_state = self._sm.state
+                if self._check_timeout():
+                    self._display_UI(old_state)
+                continue
+
+            old_state, quit = self._handle_keys(keys)
+            if quit:
+                break
+            if old_state is not None:
+                self._display_UI(old_state)
+
+        self.cleanup_curses()
+
+    """The same as run without printing the old state."""
+    def run_no_oldstate_messages(self):
+        self.init_curses()
+        self._display_UI()
+
+        while True:
+            keys = self._read_keys()
+            if not keys:
+                if self._check_timeout():
+                    self._display_UI()
+                continue
+
+            old_state, quit = self._handle_keys(keys)
+            if quit:
+                break
+            if old_state is not None:
+                self._display_UI()
+
+        self.cleanup_curses()
+
+if __name__ == '__main__':
+    combo = ComboLock()
+    combo.run()
+    #combo.run_no_oldstate_messages()
@@ -0,0 +1,147 @@
+"""One controller for a whole installation: lots of keypads, and one parent
+machine that reacts to what happens on them, like a door or an alarm.
+
+Each keypad is a child machine. Events for a keypad are sent to the
+controller with the keypad's id, and whenever a keypad reaches CODEOK or
+CODEBAD the controller sends the parent an E_CODEOK or E_CODEBAD event
+with the keypad's id as its param. The parent is an ordinary state machine
+with its own transition table, and it never has to look at the keypads."""
+from statemachine import BaseStateMachine, CompactStateMachine
+
+#The events a parent gets. 0 and 1 are E_TIMEOUT and E_KEYPRESS.
+E_CODEOK = 2
+E_CODEBAD = 3
+
+class Controller(object):
+    """Hosts any number of keypads, each behaving exactly like a
+    CompactStateMachine, and a parent machine.
+
+    A separate object per keypad costs well over 100 bytes each. Here every
+    keypad is just 5 bytes in two bytearrays, like LockBank does it:
+        states[slot]              its state
+        digits[4*slot:4*slot+4]   its entered digits
+    The digit count isn't stored, because the state already says it.
+
+    To run an event, one CompactStateMachine, the cursor, is pointed at the
+    keypad's bytes: its state is set and its _digits becomes a memoryview
+    of the keypad's 4 bytes, so the digits it writes go straight into
+    digits. The cursor's ordinary do_event does the work, and only the new
+    state has to be copied back. So the keypads run the real
+    CompactStateMachine code without each needing an object.
+
+    Keypads are numbered from 0, and a keypad's number is where its bytes
+    are, so finding one is just indexing and costs nothing extra per keypad.
+    Something that knows its keypads by name can keep its own dictionary of
+    name -> number."""
+    def __init__(self, parent, count=0):
+        self.parent = parent
+        self.states = bytearray()
+        self.digits = bytearray()
+        self._view = memoryview(self.digits)
+        self._cursor = CompactStateMachine()
+        #What to tell the parent when a keypad moves into a state.
+        self._outcomes = {
+            CompactStateMachine.CODEOK: E_CODEOK,
+            CompactStateMachine.CODEBAD: E_CODEBAD,
+            }
+        self.add(count)
+
+    def __len__(self):
+        return len(self.states)
+
+    """Adds count keypads, all at IDLE, and returns the number of the first."""
+    def add(self, count=1):
+        first = len(self.states)
+        #A bytearray can't grow while a memoryview of it exists, and the
+        #cursor holds a piece of one too.
+        self._cursor._digits = bytearray(CompactStateMachine.CODE_LENGTH)
+        self._view.release()
+        self.states += bytes(count)
+        self.digits += bytes(CompactStateMachine.CODE_LENGTH * count)
+        self._view = memoryview(self.digits)
+        return first
+
+    """The state and entered code of one keypad, like a StateMachine's
+    state and cur_code."""
+    def child(self, child_id):
+        state = self.states[child_id]
+        start = child_id * CompactStateMachine.CODE_LENGTH
+        count = min(state, CompactStateMachine.CODE_LENGTH)
+        return state, [chr(key) for key in self.digits[start:start + count]]
+
+    """Sends one event to keypad child_id and returns its new state. If that
+    made the keypad reach CODEOK or CODEBAD the parent gets its event before
+    this returns."""
+    def do_event(self, child_id, event_type, event_param=None):
+        cursor = self._cursor
+        old_state = self.states[child_id]
+        #4 is CODE_LENGTH, and also the state number of CODEOK. Every state
+        #up to it has as many digits as its number, and CODEBAD has 4 too.
+        #Written out as numbers because this runs for every event.
+        start = child_id * 4
+        cursor.state = old_state
+        cursor._count = 4 if old_state > 4 else old_state
+        cursor._digits = self._view[start:start + 4]
+        cursor.do_event(event_type, event_param)
+        state = cursor.state
+        if state != old_state:
+            self.states[child_id] = state
+            outcome = self._outcomes.get(state)
+            if outcome is not None:
+                self.parent.do_event(outcome, child_id)
+        return state
+
+class DoorMachine(BaseStateMachine):
+    """An example parent: a door with an alarm.
+
+    The door opens when any keypad gets a right code, and locks again on the
+    next timeout. Three wrong codes in a row while it is locked, from any
+    keypads, set off the alarm, which only a right code turns off.
+    opened_by is the keypad that last opened the door."""
+    STATE_NAMES = [
+        'LOCKED',
+        'OPEN',
+        'ALARM',
+        ]
+
+    LOCKED = 0
+    OPEN = 1
+    ALARM = 2
+
+    ALARM_AFTER = 3
+
+    TRANSITIONS = {
+        (LOCKED, E_CODEOK): '_transition_OPEN',
+        (LOCKED, E_CODEBAD): '_transition_BAD',
+
+        (OPEN, E_CODEOK): '_transition_OPEN',
+        (OPEN, BaseStateMachine.E_TIMEOUT): '_transition_LOCKED',
+
+        (ALARM, E_CODEOK): '_transition_LOCKED',
+        }
+
+    def __init__(self):
+        self._build_table()
+        self.opened_by = None
+        self._transition_LOCKED()
+
+    def _transition_LOCKED(self, child_id=None):
+        self.state = self.LOCKED
+        self.bad_codes = 0
+
+    def _transition_OPEN(self, child_id):
+        self.state = self.OPEN
+        self.bad_codes = 0
+        self.opened_by = child_id
+
+    def _transition_BAD(self, child_id):
+        self.bad_codes += 1
+        if self.bad_codes >= self.ALARM_AFTER:
+            self.state = self.ALARM
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
@@ -0,0 +1,127 @@
+"""Where ComboLock draws to and gets its keys from.
+
+A backend has three methods:
+    start()   sets the display up and returns the window to draw in
+    update()  sends everything drawn since the last update to the display
+    stop()    puts everything back the way it was
+The window it returns needs the few curses window methods ComboLock and
+ScreenView use: erase, border, addstr, noutrefresh, timeout and getch.
+
+CursesBackend is the real terminal. MemoryBackend draws into a list of
+strings in memory and takes its keys from a list, so the whole program can
+run without a terminal, as fast as python can go. That is how the UI gets
+tested and timed."""
+import collections
+import signal
+import sys
+
+class CursesBackend(object):
+    """Everything iter2's init_curses and cleanup_curses did. Look there
+    for what each curses call is for."""
+    def __init__(self, lines=20, cols=40):
+        self.lines = lines
+        self.cols = cols
+        self.stdscr = None
+
+    def start(self):
+        #Only imported here, so MemoryBackend works even where curses
+        #isn't available.
+        import curses
+        self._curses = curses
+
+        #This makes it so if you hit CTRL+C curses doesn't eat the terminal alive!
+        signal.signal(signal.SIGINT, self.signal_handler)
+
+        self.stdscr = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        curses.curs_set(0)
+        return curses.newwin(self.lines, self.cols, 2, 2)
+
+    def update(self):
+        self._curses.doupdate()
+
+    def stop(self):
+        self._curses.nocbreak();
+        self._curses.echo()
+        self._curses.endwin()
+
+    """function handler for when you press CTRL+C"""
+    def signal_handler(self, signal, frame):
+        self.stop()
+        sys.exit(0)
+
+class MemoryWindow(object):
+    """A pretend curses window. The screen is a list of strings, one per
+    row, and getch hands out the keys it was given one at a time. When it
+    runs out of keys it returns 'q' so the program quits.
+
+    calls counts how many times each method was called, which shows how
+    much work drawing is doing."""
+    def __init__(self, lines, cols, keys):
+        self.lines = lines
+        self.cols = cols
+        self.rows = [' ' * cols for _ in range(lines)]
+        self.calls = collections.Counter()
+        self._keys = iter(keys)
+
+    def erase(self):
+        self.calls['erase'] += 1
+        self.rows = [' ' * self.cols for _ in range(self.lines)]
+
+    def border(self):
+        self.calls['border'] += 1
+        inside = self.cols - 2
+        self.rows[0] = '+' + '-' * inside + '+'
+        self.rows[-1] = '+' + '-' * inside + '+'
+        for row in range(1, self.lines - 1):
+            self.rows[row] = '|' + self.rows[row][1:-1] + '|'
+
+    def addstr(self, row, column, text):
+        self.calls['addstr'] += 1
+        line = self.rows[row]
+        self.rows[row] = (line[:column] + text + line[column + len(text):])[:self.cols]
+
+    def noutrefresh(self):
+        self.calls['noutrefresh'] += 1
+
+    def refresh(self):
+        self.calls['refresh'] += 1
+
+    def timeout(self, delay):
+        pass
+
+    """Keys can be one character strings or key codes. -1 means 'no key
+    pressed before the timeout', the same as curses. Keys with no -1 between
+    them count as arriving together, the way pasted text does. Put a -1
+    after every key to pretend somebody is typing them one at a time."""
+    def getch(self):
+        self.calls['getch'] += 1
+        key = next(self._keys, 'q')
+        if isinstance(key, str):
+            key = ord(key)
+        return key
+
+    """The screen as one string, for printing or comparing."""
+    def dump(self):
+        return '\n'.join(self.rows)
+
+class MemoryBackend(object):
+    def __init__(self, keys=(), lines=20, cols=40):
+        self.window = MemoryWindow(lines, cols, keys)
+
+    def start(self):
+        return self.window
+
+    def update(self):
+        self.window.calls['doupdate'] += 1
+
+    def stop(self):
+        pass
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
@@ -0,0 +1,310 @@
+"""Keeping lock states safe across a restart.
+
+Normally every StateMachine only exists in memory, so if the program stops
+halfway through somebody typing a code, or right after a CODEOK, all of it
+is gone. DurableLocks writes every event it is given to a log file first,
+and when it starts again it reads the log back and ends up where it was.
+
+A log like that, written before anything else happens and only ever added
+to, is called a write-ahead log. Two things keep it fast:
+
+Group commit. Writing to a file only puts the data in the operating
+system's memory. To be sure it is really on the disk the program has to
+call fsync, which waits for the disk, and a disk can only do a few hundred
+to a few thousand of those a second. So events are collected and written
+and fsynced together, a batch at a time. One fsync for 64 events costs
+about the same as one for a single event.
+
+Checkpoints. Replaying a log that has grown for months would take forever.
+Every so often DurableLocks saves every machine (with snapshot.py) to a
+checkpoint file and starts a new, empty log. Starting up is then loading
+the checkpoint and replaying only the log written since.
+
+The log is a list of batches:
+    count       4 byte unsigned int, how many records are in the batch
+    crc         4 byte unsigned int, a checksum of the records
+    records     count records of
+                    lock_id     4 byte unsigned int
+                    event_type  1 byte
+                    key         1 byte, the key's character code (0 for timeouts)
+A lock's code is changed with set_code, which logs it as a batch of its
+own, marked by CODE_BATCH in count:
+    count       CODE_BATCH | how many codes are in the batch
+    crc         4 byte unsigned int, a checksum of the records
+    records     count records of
+                    lock_id     4 byte unsigned int
+                    length      1 byte
+                    code        length bytes, the machine's stored_code
+A HashedStateMachine's stored_code is its salt and hash, so its code
+isn't written to the log either.
+
+If the program stops while writing, the end of the file can be any part of
+a batch. Reading stops at the first batch that is cut short or whose
+checksum is wrong, and the file is cut back to there, so a batch is either
+all there or not at all."""
+import os
+import struct
+import zlib
+from array import array
+
+from snapshot import CodeTable, decode, encode
+from statemachine import StateMachine
+
+BATCH = struct.Struct('<II')
+WAL_RECORD = struct.Struct('<IBB')
+CODE_RECORD = struct.Struct('<IB')
+CODE_BATCH = 1 << 31
+CHECKPOINT = struct.Struct('<III')
+
+CHECKPOINT_NAME = 'checkpoint'
+
+def _wal_name(generation):
+    return 'wal.%d' % generation
+
+"""Renaming a file or making a new one changes the directory, and that
+has to be fsynced too or the change can be lost. Not every system lets a
+directory be opened, and there it isn't needed."""
+def _sync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+"""A checkpoint file is
+    generation, lock count, code count    3 4 byte unsigned ints
+    every stored_code                     1 byte length, then the code
+    every lock_id                         4 bytes each
+    every machine                         a snapshot.RECORD each
+generation is the number of the log that carries on from it."""
+def write_checkpoint(path, generation, machines):
+    codes = CodeTable()
+    ids = array('I', machines)
+    records = encode([machines[lock_id] for lock_id in ids], codes)
+    with open(path, 'wb') as checkpoint:
+        checkpoint.write(CHECKPOINT.pack(generation, len(ids), len(codes.codes)))
+        for code in codes.codes:
+            checkpoint.write(bytes((len(code),)) + code)
+        checkpoint.write(ids.tobytes())
+        checkpoint.write(records)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+def read_checkpoint(path, cls=StateMachine):
+    with open(path, 'rb') as checkpoint:
+        data = checkpoint.read()
+    generation, count, code_count = CHECKPOINT.unpack_from(data, 0)
+    offset = CHECKPOINT.size
+    codes = CodeTable()
+    for _ in range(code_count):
+        length = data[offset]
+        codes.number(data[offset + 1:offset + 1 + length])
+        offset += 1 + length
+    ids = array('I')
+    ids.frombytes(data[offset:offset + 4 * count])
+    offset += 4 * count
+    return generation, dict(zip(ids, decode(data[offset:], codes, cls)))
+
+"""Replays the complete batches of the log at path into machines. Returns
+how many bytes of the file were good, so the rest can be cut off, and how
+many records they held."""
+def replay_wal(path, machines, cls=StateMachine):
+    try:
+        with open(path, 'rb') as wal:
+            data = wal.read()
+    except FileNotFoundError:
+        return 0, 0
+    offset = 0
+    replayed = 0
+    while offset + BATCH.size <= len(data):
+        count, crc = BATCH.unpack_from(data, offset)
+        start = offset + BATCH.size
+        if count & CODE_BATCH:
+            count &= ~CODE_BATCH
+            batch = _read_codes(data, start, count)
+            if batch is None or zlib.crc32(data[start:batch[0]]) != crc:
+                break
+            offset, changes = batch
+            for lock_id, code in changes:
+                machine = machines.get(lock_id)
+                if machine is None:
+                    machine = machines[lock_id] = cls()
+                machine.stored_code = code
+            replayed += count
+            continue
+        end = start + count * WAL_RECORD.size
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break
+        for lock_id, event_type, key in WAL_RECORD.iter_unpack(data[start:end]):
+            machine = machines.get(lock_id)
+            if machine is None:
+                machine = machines[lock_id] = cls()
+            machine.do_event(event_type,
+                             chr(key) if event_type == cls.E_KEYPRESS else None)
+        offset = end
+        replayed += count
+    return offset, replayed
+
+"""Reads count code records starting at offset. Returns where they end
+and a list of (lock_id, stored_code), or None if the file ends first.
+The codes are only given to the machines once the checksum of the whole
+batch is right, so a batch that was cut short changes nothing."""
+def _read_codes(data, offset, count):
+    changes = []
+    for _ in range(count):
+        if offset + CODE_RECORD.size > len(data):
+            return None
+        lock_id, length = CODE_RECORD.unpack_from(data, offset)
+        offset += CODE_RECORD.size
+        if offset + length > len(data):
+            return None
+        changes.append((lock_id, data[offset:offset + length]))
+        offset += length
+    return offset, changes
+
+class DurableLocks(object):
+    """Any number of lock machines, by lock_id, that survive a restart.
+    Making one reads back whatever directory already holds.
+
+        locks = DurableLocks('state')
+        locks.do_event(17, StateMachine.E_KEYPRESS, '4')
+        locks.commit()
+
+    Events are only safe once commit has returned. Nothing should be done
+    about an event's result, like opening the door for a CODEOK, before
+    that. do_event commits by itself every group events. A server that
+    handles all waiting events and then calls commit once gets the most out
+    of every fsync. group=1 commits every event on its own.
+
+    After checkpoint_every events a checkpoint is saved and the log starts
+    over. sync=False skips fsync. Then a crash of the program still loses
+    nothing, but a crash of the whole computer can."""
+    def __init__(self, directory, cls=StateMachine, group=64,
+                 checkpoint_every=1000000, sync=True):
+        self.directory = directory
+        self.group = group
+        self.checkpoint_every = checkpoint_every
+        self.sync = sync
+        self._cls = cls
+        self._pending = bytearray()
+        self._count = 0
+        self._logged = 0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _recover(self):
+        self.generation = 0
+        self.machines = {}
+        if os.path.exists(self._path(CHECKPOINT_NAME)):
+            self.generation, self.machines = read_checkpoint(
+                self._path(CHECKPOINT_NAME), self._cls)
+
+        #Anything older than the checkpoint is already in it, and a
+        #checkpoint.tmp is one that was never finished.
+        for name in os.listdir(self.directory):
+            old_wal = (name.startswith('wal.') and name[4:].isdigit() and
+                       int(name[4:]) < self.generation)
+            if old_wal or name == CHECKPOINT_NAME + '.tmp':
+                os.remove(self._path(name))
+
+        path = self._path(_wal_name(self.generation))
+        #The replayed records count towards the next checkpoint, or a
+        #program restarted more often than every checkpoint_every events
+        #would never make one and the log would grow forever.
+        good, self._logged = replay_wal(path, self.machines, self._cls)
+        self._file = open(path, 'ab')
+        self._file.truncate(good)
+
+    """The machine for lock_id, made at IDLE if it doesn't exist yet."""
+    def machine(self, lock_id):
+        machine = self.machines.get(lock_id)
+        if machine is None:
+            machine = self.machines[lock_id] = self._cls()
+        return machine
+
+    """Changes lock_id's code and logs it, after every event before it.
+    Like everything else about a machine, a code that is set on the machine
+    directly is only saved by the next checkpoint, so use this. Returns
+    when the change is on the disk."""
+    def set_code(self, lock_id, code):
+        self.commit()
+        machine = self.machine(lock_id)
+        machine.correct_code = code
+        stored = bytes(machine.stored_code)
+        record = CODE_RECORD.pack(lock_id, len(stored)) + stored
+        self._write(BATCH.pack(CODE_BATCH | 1, zlib.crc32(record)), record, 1)
+
+    """Sends one event to lock_id's machine and adds it to the next batch.
+    Returns the machine's new state."""
+    def do_event(self, lock_id, event_type, event_param=None):
+        machine = self.machine(lock_id)
+        machine.do_event(event_type, event_param)
+        self._pending += WAL_RECORD.pack(
+            lock_id, event_type, ord(event_param) if event_param else 0)
+        self._count += 1
+        if self._count >= self.group:
+            self.commit()
+        return machine.state
+
+    """Writes every event since the last commit as one batch and waits for
+    it to be on the disk."""
+    def commit(self):
+        if not self._count:
+            return
+        count = self._count
+        self._count = 0
+        self._write(BATCH.pack(count, zlib.crc32(self._pending)),
+                    self._pending, count)
+        del self._pending[:]
+
+    def _write(self, header, records, count):
+        self._file.write(header)
+        self._file.write(records)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self._logged += count
+        if self._logged >= self.checkpoint_every:
+            self.checkpoint()
+
+    """Saves every machine and starts a new log. The checkpoint is written
+    to checkpoint.tmp and then renamed, because a rename either happens
+    completely or not at all. Until the rename the old checkpoint and log
+    are still there, so stopping at any point loses nothing."""
+    def checkpoint(self):
+        self.commit()
+        generation = self.generation + 1
+        temporary = self._path(CHECKPOINT_NAME + '.tmp')
+        write_checkpoint(temporary, generation, self.machines)
+        os.replace(temporary, self._path(CHECKPOINT_NAME))
+        _sync_directory(self.directory)
+
+        self._file.close()
+        os.remove(self._path(_wal_name(self.generation)))
+        self.generation = generation
+        self._file = open(self._path(_wal_name(generation)), 'ab')
+        _sync_directory(self.directory)
+        self._logged = 0
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
@@ -0,0 +1,201 @@
+"""A binary file format for logs of keypad events.
+
+Every record is exactly RECORD.size (14) bytes:
+    lock_id     4 byte unsigned int
+    timestamp   8 byte float, seconds
+    event_type  1 byte, StateMachine.E_KEYPRESS or StateMachine.E_TIMEOUT
+    key         1 byte, the key's character code (0 for timeouts)
+all little endian with no padding. Because every record is the same size,
+record number i always starts at byte i * RECORD.size, and reading the log
+never involves searching for the end of a line or parsing text.
+
+The reader uses mmap, which asks the operating system to make the file look
+like one big bytes object without reading it in. Pages of the file are
+loaded when they are touched and can be dropped again when memory is
+needed, so a log much bigger than memory can still be replayed.
+read more at:
+https://docs.python.org/3/library/mmap.html"""
+import mmap
+import struct
+from array import array
+
+from statemachine import StateMachine
+
+RECORD = struct.Struct('<IdBB')
+
+"""The same layout as RECORD, as a NumPy dtype. The last two fields are
+named like do_events expects, so a slice of the array can be passed
+straight to StateMachine.do_events."""
+RECORD_FIELDS = [('lock_id', '<u4'), ('timestamp', '<f8'),
+                 ('event_type', 'u1'), ('param', 'u1')]
+
+class EventLogWriter(object):
+    """Appends records to a log. Records are packed into a buffer and
+    written out flush_every records at a time instead of one at a time.
+    Use it in a with statement so the last records always get written:
+        with EventLogWriter('keys.bin') as log:
+            log.write(17, time.time(), StateMachine.E_KEYPRESS, '4')
+    New records go after the ones already in the file. append=False
+    empties the file first."""
+    def __init__(self, path, flush_every=4096, append=True):
+        self._file = open(path, 'ab' if append else 'wb')
+        self._buffer = bytearray()
+        self._flush_bytes = flush_every * RECORD.size
+
+    """key can be a one character string or its character code."""
+    def write(self, lock_id, timestamp, event_type, key=0):
+        if isinstance(key, str):
+            key = ord(key)
+        self._buffer += RECORD.pack(lock_id, timestamp, event_type, key)
+        if len(self._buffer) >= self._flush_bytes:
+            self.flush()
+
+    def flush(self):
+        self._file.write(self._buffer)
+        del self._buffer[:]
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class EventLogReader(object):
+    """Reads a log written by EventLogWriter without copying it into
+    memory. A partly written record at the end of the file (from a writer
+    that was stopped halfway) is ignored."""
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._count = 0
+        self._map = None
+        size = self._file.seek(0, 2)
+        if size >= RECORD.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._count = size // RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    """A memoryview is a window onto the mmap. Slicing it gives another
+    window, not a copy."""
+    def _view(self, start, stop):
+        return memoryview(self._map)[start * RECORD.size:stop * RECORD.size]
+
+    """Yields (lock_id, timestamp, event_type, key) for every record, with
+    key turned back into a one character string like StateMachine expects.
+    struct.iter_unpack reads straight out of the mapped file, chunk records
+    at a time."""
+    def records(self, chunk=65536):
+        for start in range(0, self._count, chunk):
+            stop = min(start + chunk, self._count)
+            for lock_id, timestamp, event_type, key in RECORD.iter_unpack(
+                    self._view(start, stop)):
+                yield lock_id, timestamp, event_type, chr(key)
+
+    """The last record, the same way records gives it, or None if the log
+    is empty."""
+    def last(self):
+        if not self._count:
+            return None
+        lock_id, timestamp, event_type, key = RECORD.unpack(
+            self._view(self._count - 1, self._count))
+        return lock_id, timestamp, event_type, chr(key)
+
+    """The whole log as a NumPy structured array (see RECORD_FIELDS). The
+    array uses the mapped file as its memory, so making it copies nothing.
+    NumPy has to be installed to use this."""
+    def array(self):
+        import numpy as np
+        if self._map is None:
+            return np.zeros(0, dtype=RECORD_FIELDS)
+        return np.frombuffer(self._map, dtype=RECORD_FIELDS, count=self._count)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+"""The same as replay.read_log but for binary logs, so replay.py can use
+either kind. With shards > 1 NumPy picks out the records whose
+lock_id % shards == shard from each chunk before anything is unpacked, so
+a worker only pays to unpack its own shard."""
+def read_binary_log(path, shard=0, shards=1, chunk=65536):
+    with EventLogReader(path) as log:
+        if shards == 1:
+            yield from log.records(chunk)
+            return
+        records = log.array()
+        try:
+            for start in range(0, len(records), chunk):
+                block = records[start:start + chunk]
+                block = block[block['lock_id'] % shards == shard]
+                for lock_id, timestamp, event_type, key in RECORD.iter_unpack(
+                        block.tobytes()):
+                    yield lock_id, timestamp, event_type, chr(key)
+        finally:
+            #The array points into the mapped file, which can't be closed
+            #while anything points into it.
+            del records
+
+"""Runs every event of one lock in the log through machine using do_events.
+The log is gone through chunk records at a time. NumPy picks out the lock's
+records from each chunk, and do_events pulls the two columns it needs out
+of them in one go, so the records are never unpacked one at a time and the
+memory used depends on chunk, not on how big the log is."""
+def replay_lock(path, lock_id, machine=None, record_states=False, chunk=65536):
+    machine = machine or StateMachine()
+    states = array('b')
+    with EventLogReader(path) as log:
+        records = log.array()
+        for start in range(0, len(records), chunk):
+            block = records[start:start + chunk]
+            block = block[block['lock_id'] == lock_id]
+            if record_states:
+                states.extend(machine.do_events(block, True))
+            else:
+                machine.do_events(block)
+        #The array still points into the mapped file, which can't be closed
+        #while anything points into it.
+        del records
+    if record_states:
+        return states
+    return machine.state
+
+"""The same as replay_lock for many locks at once, in one pass over the log.
+machines is a dictionary of lock_id -> machine, and only those locks are
+replayed. Each chunk's records for those locks are sorted by lock_id,
+keeping their order within a lock, so every lock gets one do_events call
+per chunk."""
+def replay_locks(path, machines, chunk=65536):
+    import numpy as np
+    wanted = np.fromiter(machines, dtype='<u4', count=len(machines))
+    with EventLogReader(path) as log:
+        records = log.array()
+        for start in range(0, len(records), chunk):
+            block = records[start:start + chunk]
+            block = block[np.isin(block['lock_id'], wanted)]
+            block = block[np.argsort(block['lock_id'], kind='stable')]
+            lock_ids, starts = np.unique(block['lock_id'], return_index=True)
+            ends = np.append(starts[1:], len(block))
+            for lock_id, begin, end in zip(lock_ids.tolist(), starts.tolist(),
+                                           ends.tolist()):
+                machines[lock_id].do_events(block[begin:end])
+        del records
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python replay.py --binary keys.bin\n"
+          "from this directory.")
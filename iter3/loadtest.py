@@ -0,0 +1,170 @@
+"""Measures how many keypad sessions one server.py process can keep up with.
+
+    python loadtest.py --sessions 2000 --codes 20
+
+starts server.py in its own process (so the server gets a core to itself),
+opens that many connections at once, and has every one of them type that
+many codes as fast as the server answers. Pass --port of a server that is
+already running with --no-server to test it instead.
+
+    python loadtest.py --ramp --interval 1
+
+finds out how many sessions it takes before the server falls behind. Every
+session types a code every --interval seconds, like somebody at a keypad
+would, and the number of sessions is doubled, starting at --sessions,
+until answers get slower than --max-latency. The server is one process
+with one thread, so the most sessions it kept up with is also how many
+sessions one core can take. The sessions themselves run in this
+process, so on a computer with only one core they share it with the
+server and the answer is too low."""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+"""Types codes keys into one connection and reads back one line per key.
+Every other code is the right one, so the server has to go through both
+CODEOK and CODEBAD. Returns how many CODEOK lines came back.
+
+With an interval, a code is due every interval seconds, and the sessions
+start at random times within the first one so they don't all type at once.
+How long each code took to be answered is added to latencies. That is
+counted from when the code was due, not from when it was sent, so a
+session that has fallen behind shows up as slow answers instead of just
+sending fewer codes."""
+async def run_session(host, port, codes, interval=0.0, latencies=None):
+    loop = asyncio.get_running_loop()
+    reader, writer = await asyncio.open_connection(host, port)
+    if interval:
+        await asyncio.sleep(random.uniform(0, interval))
+    due = loop.time()
+    ok = 0
+    for i in range(codes):
+        if not interval:
+            due = loop.time()
+        #A code is four digits and then one more key to go back to IDLE.
+        writer.write(b'12340' if i % 2 == 0 else b'99990')
+        await writer.drain()
+        for _ in range(5):
+            if await reader.readline() == b'CODEOK\n':
+                ok += 1
+        if latencies is not None:
+            latencies.append(loop.time() - due)
+        if interval:
+            due += interval
+            await asyncio.sleep(max(0.0, due - loop.time()))
+    writer.close()
+    return ok
+
+"""Runs sessions sessions at once. Returns how long they took and every
+code's latency, sorted."""
+async def run_load(host, port, sessions, codes, interval=0.0):
+    latencies = []
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[run_session(host, port, codes, interval, latencies)
+          for _ in range(sessions)])
+    elapsed = time.perf_counter() - start
+    if sum(results) != sessions * ((codes + 1) // 2):
+        raise AssertionError("wrong number of CODEOK answers")
+    latencies.sort()
+    return elapsed, latencies
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def report(sessions, codes, elapsed, latencies):
+    keys = sessions * codes * 5
+    print("%6d sessions  %8.0f keys/sec  latency p50 %6.1fms  p99 %6.1fms"
+          % (sessions, keys / elapsed, percentile(latencies, 0.5) * 1e3,
+             percentile(latencies, 0.99) * 1e3))
+    return keys / elapsed
+
+"""Doubles the number of sessions until the server falls behind, and
+returns the most it kept up with (0 if it never did).
+
+Falling behind is the 99th percentile latency going over max_latency.
+Without an interval every session types as fast as it can, so more
+sessions always means slower answers, and it is also falling behind when
+the keys per second stop going up by at least 5%, because then the server
+is as busy as it can get."""
+async def ramp(host, port, sessions, codes, interval, max_latency, max_sessions):
+    kept_up = 0
+    best = 0.0
+    while sessions <= max_sessions:
+        elapsed, latencies = await run_load(host, port, sessions, codes, interval)
+        throughput = report(sessions, codes, elapsed, latencies)
+        if percentile(latencies, 0.99) > max_latency:
+            print("p99 latency is over %.0fms" % (max_latency * 1e3))
+            break
+        if not interval and throughput < best * 1.05:
+            print("keys/sec stopped going up")
+            break
+        kept_up = sessions
+        best = max(best, throughput)
+        sessions *= 2
+    return kept_up
+
+"""Waits until the server is accepting connections."""
+async def wait_for_server(host, port, tries=50):
+    for _ in range(tries):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            return
+    raise RuntimeError("server did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--sessions', type=int, default=1000,
+                        help='sessions, or the sessions to start a ramp at')
+    parser.add_argument('--codes', type=int, default=20)
+    parser.add_argument('--no-server', action='store_true',
+                        help='use a server that is already running')
+    parser.add_argument('--ramp', action='store_true',
+                        help='double the sessions until the server falls behind')
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help='seconds between the codes of a session, '
+                             '0 for as fast as possible')
+    parser.add_argument('--max-latency', type=float, default=0.1,
+                        help='slowest p99 answer to a code, in seconds, '
+                             'that still counts as keeping up')
+    parser.add_argument('--max-sessions', type=int, default=16000,
+                        help='where a ramp stops (each session is an open file)')
+    args = parser.parse_args()
+
+    server = None
+    if not args.no_server:
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'server.py'),
+             '--host', args.host, '--port', str(args.port)])
+    try:
+        asyncio.run(wait_for_server(args.host, args.port))
+        if args.ramp:
+            kept_up = asyncio.run(ramp(args.host, args.port, args.sessions,
+                                       args.codes, args.interval,
+                                       args.max_latency, args.max_sessions))
+            print("%d sessions per server core (%d cores on this computer, "
+                  "shared with the sessions)" % (kept_up, os.cpu_count()))
+        else:
+            elapsed, latencies = asyncio.run(run_load(
+                args.host, args.port, args.sessions, args.codes, args.interval))
+            throughput = report(args.sessions, args.codes, elapsed, latencies)
+            print("%.0f codes/sec on one server core" % (throughput / 5))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__':
+    main()
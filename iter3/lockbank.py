@@ -0,0 +1,93 @@
+"""NumPy is a library for doing math on whole arrays of numbers at once.
+read more at:
+https://numpy.org/doc/stable/user/absolute_beginners.html"""
+import numpy as np
+
+from statemachine import StateMachine
+
+class LockBank(object):
+    """A LockBank is a whole row of StateMachines stored as arrays instead of
+    as separate objects. Lock number i is
+        state[i]      the same state number a StateMachine would have
+        digits[i]     the digits entered so far, as key codes
+    Every event is applied to all of the locks at the same time, so the
+    python code in apply runs once per event column, not once per lock.
+
+    A lock's digit count is never stored, because the state already says it:
+    ONEDIGIT has one digit, THREEDIGIT three, and CODEOK/CODEBAD all four.
+
+    dirty[i] is set whenever lock i changes, so snapshot.py can save only
+    the locks that changed since the last snapshot. Whoever saves them
+    clears it."""
+    CODE_LENGTH = 4
+
+    """correct_code can be one code for every lock, like b'1234', or an
+    array with a row per lock if each lock has a different code."""
+    def __init__(self, count, correct_code=b'1234'):
+        self.state = np.full(count, StateMachine.IDLE, dtype=np.int8)
+        self.digits = np.zeros((count, self.CODE_LENGTH), dtype=np.uint8)
+        self.dirty = np.zeros(count, dtype=bool)
+        if isinstance(correct_code, bytes):
+            correct_code = np.frombuffer(correct_code, dtype=np.uint8)
+        self.correct_code = np.asarray(correct_code, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.state)
+
+    """Gives one lock's entered digits in the same form as
+    StateMachine.cur_code, a list of one character strings."""
+    def cur_code(self, index):
+        count = min(int(self.state[index]), self.CODE_LENGTH)
+        return [chr(key) for key in self.digits[index, :count]]
+
+    """Applies one event to every lock. event_types and params can be single
+    values, which are used for every lock, or arrays with one value per lock.
+    params are key codes, like getch returns, not strings.
+
+    This does the same thing as StateMachine.do_event, but instead of asking
+    'what state is this lock in?' it asks 'which locks are in this state?'
+    and gets back a True/False array, called a mask, with one entry per lock."""
+    def apply(self, event_types, params=0):
+        state = self.state
+        event_types = np.broadcast_to(event_types, state.shape)
+        params = np.broadcast_to(np.asarray(params, dtype=np.uint8), state.shape)
+
+        keypress = event_types == StateMachine.E_KEYPRESS
+        timeout = event_types == StateMachine.E_TIMEOUT
+
+        #IDLE, ONEDIGIT, TWODIGIT and THREEDIGIT take a digit on a keypress.
+        #The number of digits already entered is the same as the state number,
+        #so that is also the column the new digit goes into.
+        entering = np.flatnonzero(keypress & (state <= StateMachine.THREEDIGIT))
+
+        #CODEOK and CODEBAD go back to IDLE on a keypress, and the partial
+        #code states go back to IDLE on a timeout.
+        reset = ((keypress & (state >= StateMachine.CODEOK)) |
+                 (timeout & (state >= StateMachine.ONEDIGIT) &
+                  (state <= StateMachine.THREEDIGIT)))
+
+        self.digits[entering, state[entering]] = params[entering]
+        state[entering] += 1
+
+        #The locks that just went from THREEDIGIT to CODEOK are the ones that
+        #now have all four digits. Compare their whole rows at once and
+        #move the ones that didn't match to CODEBAD.
+        finished = entering[state[entering] == StateMachine.CODEOK]
+        correct = self.correct_code
+        if correct.ndim == 2:
+            correct = correct[finished]
+        wrong = ~np.all(self.digits[finished] == correct, axis=1)
+        state[finished[wrong]] = StateMachine.CODEBAD
+
+        state[reset] = StateMachine.IDLE
+        self.digits[reset] = 0
+
+        self.dirty[entering] = True
+        self.dirty |= reset
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
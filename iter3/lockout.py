@@ -0,0 +1,107 @@
+"""Stops people from guessing codes as fast as they can type.
+
+After attempts wrong codes in a row, a lock goes to LOCKEDOUT and ignores
+every key until its lockout is over. Each wrong code after that doubles how
+long the next lockout lasts (up to max_delay), until somebody gets the code
+right."""
+import time
+from array import array
+
+from statemachine import StateMachine
+
+class LockoutBoard(object):
+    """The lockout information for many locks, numbered 0 to count - 1. For
+    each lock there is just
+        failures[i]   wrong codes in a row, 2 bytes
+        until[i]      when its lockout ends, 8 bytes (0 means never locked)
+    no matter how many guesses there were.
+
+    Because it is all in two arrays, anything can ask whether a lock is
+    locked out without going through its state machine. A server can check
+    is_locked before calling do_event and throw away keys from locked out
+    keypads without spending any more time on them."""
+    def __init__(self, count, attempts=3, delay=1.0, max_delay=3600.0):
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.failures = array('H', bytes(2 * count))
+        self.until = array('d', bytes(8 * count))
+
+    def __len__(self):
+        return len(self.failures)
+
+    """Counts a wrong code. Returns True if that locked the lock out."""
+    def record_failure(self, index, now):
+        failures = min(self.failures[index] + 1, 0xffff)
+        self.failures[index] = failures
+        if failures < self.attempts:
+            return False
+        #min on the power first, so a huge failure count can't make a
+        #number too big for a float.
+        doublings = min(failures - self.attempts, 64)
+        self.until[index] = now + min(self.max_delay, self.delay * 2 ** doublings)
+        return True
+
+    def record_success(self, index):
+        self.failures[index] = 0
+        self.until[index] = 0.0
+
+    def is_locked(self, index, now):
+        return self.until[index] > now
+
+    """Every lock that is locked out at time now. With NumPy installed, pass
+    numpy=True to get a True/False array with one entry per lock instead,
+    which is much faster for a lot of locks."""
+    def locked(self, now, numpy=False):
+        if numpy:
+            import numpy as np
+            return np.frombuffer(self.until, dtype=np.float64) > now
+        return [index for index, until in enumerate(self.until) if until > now]
+
+class LockoutStateMachine(StateMachine):
+    """A StateMachine with a LOCKEDOUT state. It keeps its lockout
+    information in slot index of a LockoutBoard, so many machines can share
+    one board. Without a board it gets one of its own.
+
+    clock is where the machine gets the time from. Replaying a log should
+    pass something that returns the log's time instead."""
+    STATE_NAMES = StateMachine.STATE_NAMES + ['LOCKEDOUT']
+
+    LOCKEDOUT = 6
+
+    TRANSITIONS = dict(StateMachine.TRANSITIONS)
+    TRANSITIONS.update({
+        (LOCKEDOUT, StateMachine.E_KEYPRESS): '_transition_UNLOCK',
+        (LOCKEDOUT, StateMachine.E_TIMEOUT): '_transition_UNLOCK',
+        })
+
+    def __init__(self, board=None, index=0, clock=time.monotonic):
+        #A LockoutBoard has a length, so an empty one is false. Only a
+        #missing board should get replaced.
+        if board is None:
+            board = LockoutBoard(1)
+        self.board = board
+        self.index = index
+        self.clock = clock
+        StateMachine.__init__(self)
+
+    def _transition_GOODBAD(self, keycode):
+        StateMachine._transition_GOODBAD(self, keycode)
+        if self.state == self.CODEOK:
+            self.board.record_success(self.index)
+        elif self.board.record_failure(self.index, self.clock()):
+            self.state = self.LOCKEDOUT
+
+    """Keys pressed while locked out are ignored. The first key or timeout
+    after the lockout is over goes back to IDLE, the same way a key does
+    after CODEBAD."""
+    def _transition_UNLOCK(self, keycode=None):
+        if not self.board.is_locked(self.index, self.clock()):
+            self._transition_IDLE()
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
@@ -0,0 +1,568 @@
+"""Proves two state machines behave the same, instead of hoping random keys
+would have found the difference.
+
+    python modelcheck.py
+checks every iter3 machine against iter2's StateMachine, trying every
+digit and every key of the codes.
+    python modelcheck.py --alphabet 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ
+tries every one of those keys too, which takes much longer, and
+--symmetric makes that faster (see check_symmetry).
+
+A machine's configuration is everything that decides what it does next:
+for StateMachine that is its state and cur_code. The checker starts both
+machines at IDLE and tries every event (a timeout, or any key) on every
+configuration pair it can reach, until no new pairs turn up. After every
+event both machines are asked what they look like from the outside, and
+the first time the answers differ the checker stops and returns the events
+that got there.
+
+It searches breadth first, one event deeper at a time, so the events it
+returns are the shortest way to show the difference.
+
+Every configuration is packed into one int, and a pair of them into one
+bigger int, so a set of pairs is just a set of numbers and millions of
+them fit in memory. Each machine is made once. To try an event on a
+configuration, the same machine is moved into that configuration by
+setting its attributes, instead of building a new machine every time."""
+import argparse
+import random
+import string
+import sys
+import time
+
+from codemachine import CodeMachine
+from statemachine import BaseStateMachine
+
+E_TIMEOUT = BaseStateMachine.E_TIMEOUT
+E_KEYPRESS = BaseStateMachine.E_KEYPRESS
+
+#A pair is the reference's configuration shifted up by PAIR_BITS, with the
+#candidate's in the bits below it.
+PAIR_BITS = 64
+PAIR_MASK = (1 << PAIR_BITS) - 1
+
+"""ONEDIGIT, TWODIGIT and THREEDIGIT are all 'entering a code', which is
+what CodeMachine calls ENTERING. Comparing by this name lets machines with
+different states be checked against each other."""
+def phase(name):
+    if name.endswith('DIGIT'):
+        return 'ENTERING'
+    return name
+
+def _same(number, table):
+    return number
+
+class Model(object):
+    """How the checker sees one kind of machine.
+        make()               a new machine at IDLE
+        save(machine)        its configuration as an int
+        load(machine, number)
+                             moves machine into configuration number
+        observe(number)      what can be seen from the outside in that
+                             configuration, for comparing
+        step(machine, event_type, param)
+                             sends it one event, do_event by default
+        show(number)         observe in a form that reads well when
+                             printed, observe by default
+        rename(number, table)
+                             the configuration with every key it holds
+                             swapped by table, a bytes.maketrans table.
+                             Only check_symmetry uses it. By default the
+                             configuration is returned as it is, which is
+                             right for machines that don't keep keys.
+    """
+    def __init__(self, name, make, save, load, observe, step=None,
+                 show=None, rename=_same):
+        self.name = name
+        self.make = make
+        self.save = save
+        self.load = load
+        self.observe = observe
+        if step is not None:
+            self.step = step
+        self.show = show or observe
+        self.rename = rename
+
+    def step(self, machine, event_type, param):
+        machine.do_event(event_type, param)
+
+"""Machines that keep the keys entered so far are all packed the same way:
+    bits 0-7     state
+    bits 8-15    how many keys are held
+    bits 16-     the keys' character codes, one byte each, first one lowest
+"""
+def _pack_code(state, code):
+    return int.from_bytes(code, 'little') << 16 | len(code) << 8 | state
+
+def _code(number):
+    return (number >> 16).to_bytes(number >> 8 & 255, 'little')
+
+def _rename_code(number, table):
+    return _pack_code(number & 255, _code(number).translate(table))
+
+"""For anything with state and cur_code like StateMachine. With
+digits=False only the number of digits entered is compared, which is all
+a CodeMachine can show.
+
+Machines with CompactStateMachine's _digits buffer are saved and loaded
+straight from it. cur_code would build a list every time, and setting it
+is only meant for snapshot.py."""
+def statemachine_model(make, name=None, digits=True):
+    sample = make()
+    phases = [phase(state_name) for state_name in sample.STATE_NAMES]
+
+    if hasattr(sample, '_digits'):
+        def save(machine):
+            count = machine._count
+            return (int.from_bytes(machine._digits[:count], 'little') << 16 |
+                    count << 8 | machine.state)
+
+        def load(machine, number):
+            count = number >> 8 & 255
+            machine.state = number & 255
+            machine._count = count
+            machine._digits[:count] = (number >> 16).to_bytes(count, 'little')
+    else:
+        def save(machine):
+            return _pack_code(machine.state,
+                              ''.join(machine.cur_code).encode('latin-1'))
+
+        def load(machine, number):
+            machine.state = number & 255
+            machine.cur_code = list(_code(number).decode('latin-1'))
+
+    if digits:
+        def observe(number):
+            return phases[number & 255], number >> 8
+
+        def show(number):
+            return phases[number & 255], _code(number).decode('latin-1')
+    else:
+        def observe(number):
+            return phases[number & 255], number >> 8 & 255
+        show = observe
+
+    return Model(name or make.__name__, make, save, load, observe,
+                 show=show, rename=_rename_code)
+
+"""CodeMachine doesn't keep keys, so its configuration is
+    bits 0-3     state
+    bit 4        matching
+    bits 8-      count
+"""
+def codemachine_model(make, name=None):
+    phases = [phase(state_name) for state_name in make().STATE_NAMES]
+
+    def save(machine):
+        return machine.count << 8 | machine.matching << 4 | machine.state
+
+    def load(machine, number):
+        machine.state = number & 15
+        machine.matching = bool(number >> 4 & 1)
+        machine.count = number >> 8
+
+    def observe(number):
+        return phases[number & 15], number >> 8
+
+    return Model(name or 'CodeMachine', make, save, load, observe)
+
+"""Machines that accept any of several codes remember their place among
+the codes, which isn't a number: a trie node for MultiCodeMachine, the
+keys so far for PrefixMachine. Every place gets a number the first time it
+is seen, and the configuration is
+    bits 0-7     state
+    bits 8-23    count
+    bits 24-     the place's number
+place(machine) gives the place and something to tell it apart by, which
+has to be hashable. What can be seen from the outside is the state, the
+count and, at CODEOK, whose code it was, which user(place) tells. With
+user None the count is all, which is all a CodeMachine can show."""
+def _places_model(name, make, place, set_place, user):
+    sample = make()
+    phases = [phase(state_name) for state_name in sample.STATE_NAMES]
+    codeok = sample.CODEOK
+    places = []
+    numbers = {}
+
+    def save(machine):
+        key, value = place(machine)
+        number = numbers.get(key)
+        if number is None:
+            number = numbers[key] = len(places)
+            places.append(value)
+        return number << 24 | machine.count << 8 | machine.state
+
+    def load(machine, number):
+        machine.state = number & 255
+        machine.count = number >> 8 & 0xffff
+        set_place(machine, places[number >> 24])
+
+    if user is None:
+        def observe(number):
+            return phases[number & 255], number >> 8 & 0xffff
+    else:
+        def observe(number):
+            state = number & 255
+            return (phases[state], number >> 8 & 0xffff,
+                    user(places[number >> 24]) if state == codeok else None)
+
+    return Model(name, make, save, load, observe)
+
+"""MultiCodeMachine's place is a dictionary in the trie, so it is told
+apart by its id. Keeping the node in places also stops the id being
+reused. At CODEOK the place is the user, which is only compared if users
+is True."""
+def multicode_model(make, name=None, users=True):
+    def set_place(machine, node):
+        machine._node = node
+        if machine.state == machine.CODEOK:
+            machine.user = node
+
+    return _places_model(name or 'MultiCodeMachine', make,
+                         lambda machine: (id(machine._node), machine._node),
+                         set_place, (lambda node: node) if users else None)
+
+class PrefixMachine(object):
+    """The plain way to accept any one of several codes, to check
+    MultiCodeMachine against: the keys entered so far are kept as a string
+    while they are the start of some code, and looked up in a set of every
+    code's starts. Once they aren't the start of any code the string is
+    dropped and the keys are only counted. codes is user -> code, like
+    CodeIndex takes. It uses CodeMachine's state numbers, but none of its
+    code."""
+    STATE_NAMES = CodeMachine.STATE_NAMES
+    IDLE = CodeMachine.IDLE
+    ENTERING = CodeMachine.ENTERING
+    CODEOK = CodeMachine.CODEOK
+    CODEBAD = CodeMachine.CODEBAD
+
+    def __init__(self, codes):
+        self.users = dict((code, user) for user, code in codes.items())
+        self.starts = set(code[:length] for code in self.users
+                          for length in range(len(code) + 1))
+        self.code_length = len(next(iter(self.users)))
+        self.reset()
+
+    def reset(self):
+        self.state = self.IDLE
+        self.count = 0
+        self.entered = ''
+
+    def do_event(self, event_type, param):
+        if event_type == E_TIMEOUT:
+            if self.state == self.ENTERING:
+                self.reset()
+        elif self.state in (self.CODEOK, self.CODEBAD):
+            self.reset()
+        else:
+            self.count += 1
+            if self.entered is not None:
+                self.entered += param
+                if self.entered not in self.starts:
+                    self.entered = None
+            if self.count < self.code_length:
+                self.state = self.ENTERING
+            elif self.entered is None:
+                self.state = self.CODEBAD
+            else:
+                self.state = self.CODEOK
+
+def prefix_model(codes, name='PrefixMachine'):
+    users = dict((code, user) for user, code in codes.items())
+
+    def set_place(machine, entered):
+        machine.entered = entered
+
+    return _places_model(name, lambda: PrefixMachine(codes),
+                         lambda machine: (machine.entered, machine.entered),
+                         set_place, users.get)
+
+"""A LockBank with a single lock, sent one event at a time. It is packed
+like a StateMachine, with the count worked out from the state."""
+def lockbank_model(name='LockBank'):
+    import numpy as np
+    from lockbank import LockBank
+    from statemachine import StateMachine
+    width = LockBank.CODE_LENGTH
+    phases = [phase(state_name) for state_name in StateMachine.STATE_NAMES]
+
+    def save(bank):
+        state = int(bank.state[0])
+        count = min(state, width)
+        return _pack_code(state, bank.digits[0, :count].tobytes())
+
+    def load(bank, number):
+        bank.state[0] = number & 255
+        bank.digits[0] = np.frombuffer((number >> 16).to_bytes(width, 'little'),
+                                       np.uint8)
+
+    def observe(number):
+        return phases[number & 255], number >> 8
+
+    def show(number):
+        return phases[number & 255], _code(number).decode('latin-1')
+
+    def step(bank, event_type, param):
+        bank.apply(event_type, ord(param) if param is not None else 0)
+
+    return Model(name, lambda: LockBank(1), save, load, observe, step,
+                 show=show, rename=_rename_code)
+
+class Counterexample(object):
+    """The shortest list of events after which the two machines look
+    different, and what each of them looked like then."""
+    def __init__(self, events, expected, got):
+        self.events = events
+        self.expected = expected
+        self.got = got
+
+    def __str__(self):
+        keys = ' '.join('<timeout>' if event_type == E_TIMEOUT else repr(param)
+                        for event_type, param in self.events)
+        return "after %s: expected %r, got %r" % (keys, self.expected, self.got)
+
+"""Checks reference and candidate against each other with every key in
+keys. Returns None if they always look the same, or a Counterexample.
+stats, if given, is a dictionary that gets the number of configuration
+pairs seen and the number of events tried."""
+def check(reference, candidate, keys, stats=None):
+    events = [(E_TIMEOUT, None)] + [(E_KEYPRESS, key) for key in keys]
+    count = len(events)
+    a, b = reference.make(), candidate.make()
+    #Looked up once here instead of on every event.
+    save_a, load_a, step_a, observe_a = (reference.save, reference.load,
+                                         reference.step, reference.observe)
+    save_b, load_b, step_b, observe_b = (candidate.save, candidate.load,
+                                         candidate.step, candidate.observe)
+
+    config_a, config_b = save_a(a), save_b(b)
+    if observe_a(config_a) != observe_b(config_b):
+        return Counterexample([], reference.show(config_a), candidate.show(config_b))
+    start = config_a << PAIR_BITS | config_b
+    #For every pair, the pair it was reached from times the number of
+    #events plus the number of the event that did it, to rebuild the path
+    #at the end. One int instead of a tuple keeps the dictionary smaller.
+    parents = {start: None}
+    frontier = [start]
+    tried = 0
+    while frontier:
+        next_frontier = []
+        for config in frontier:
+            config_a, config_b = config >> PAIR_BITS, config & PAIR_MASK
+            for number, (event_type, param) in enumerate(events):
+                load_a(a, config_a)
+                load_b(b, config_b)
+                step_a(a, event_type, param)
+                step_b(b, event_type, param)
+                next_a, next_b = save_a(a), save_b(b)
+                if observe_a(next_a) != observe_b(next_b):
+                    return Counterexample(
+                        _path(parents, config, events) + [events[number]],
+                        reference.show(next_a), candidate.show(next_b))
+                child = next_a << PAIR_BITS | next_b
+                if child not in parents:
+                    if next_b > PAIR_MASK:
+                        raise ValueError("%s configuration needs more than "
+                                         "%d bits" % (candidate.name, PAIR_BITS))
+                    parents[child] = config * count + number
+                    next_frontier.append(child)
+            tried += count
+        frontier = next_frontier
+    if stats is not None:
+        stats['configs'] = len(parents)
+        stats['events'] = tried
+    return None
+
+def _path(parents, config, events):
+    path = []
+    while parents[config] is not None:
+        config, number = divmod(parents[config], len(events))
+        path.append(events[number])
+    path.reverse()
+    return path
+
+"""The keys for a check with --symmetric: every key used in a code, plus
+representatives, keys from alphabet that aren't in any code, to stand for
+all the others. A configuration holds at most hold keys, so with hold + 1
+representatives there is always one that isn't in it yet. If alphabet
+doesn't have that many other keys, it is simply all of alphabet.
+Returns the keys, the representatives and the keys they stand for."""
+def symmetric_keys(codes, alphabet, hold):
+    keys = sorted(set(''.join(codes)))
+    others = [key for key in alphabet if key not in keys]
+    representatives = others[:hold + 1]
+    return keys + representatives, representatives, others[hold + 1:]
+
+"""Checking with a few representatives instead of every key is only right
+if the machine treats every key outside the codes the same way. That is
+what a combo lock should do, and also exactly what an optimized machine
+might get wrong, so this checks it instead of assuming it.
+
+model is explored on its own with keys, and at every configuration it
+reaches, every key in others has to do what a representative does, with
+the two swapped:
+  - pressed as a new key, it has to end up where a representative the
+    configuration doesn't hold yet ends up, with that representative
+    renamed to it, and
+  - swapped with every representative the configuration already holds,
+    every event has to do the same as on the real configuration, swapped.
+Returns None, or a description of the first difference.
+
+That finds a machine that treats some key differently when it is pressed
+or while it is held. It doesn't try every way several of the other keys
+could be held at once, which only trying every key does."""
+def check_symmetry(model, keys, representatives, others, stats=None):
+    events = [(E_TIMEOUT, None)] + [(E_KEYPRESS, key) for key in keys]
+    machine = model.make()
+    save, load, step, rename = model.save, model.load, model.step, model.rename
+
+    def after(config, event_type, param):
+        load(machine, config)
+        step(machine, event_type, param)
+        return save(machine)
+
+    #Every configuration keys can reach, with where each event takes it.
+    start = save(machine)
+    moves = {start: None}
+    frontier = [start]
+    while frontier:
+        next_frontier = []
+        for config in frontier:
+            children = moves[config] = [after(config, event_type, param)
+                                        for event_type, param in events]
+            for child in children:
+                if child not in moves:
+                    moves[child] = None
+                    next_frontier.append(child)
+        frontier = next_frontier
+
+    tables = {}
+    for representative in representatives:
+        for other in others:
+            swap = (representative + other).encode('latin-1')
+            tables[representative, other] = bytes.maketrans(swap, swap[::-1])
+    tried = 0
+    for config, children in moves.items():
+        for other in others:
+            fresh = False
+            for representative in representatives:
+                table = tables[representative, other]
+                swapped = rename(config, table)
+                if swapped == config:
+                    #Not held, so only one of these needs trying.
+                    if not fresh:
+                        fresh = True
+                        tried += 1
+                        if (after(config, E_KEYPRESS, other) !=
+                                rename(children[keys.index(representative) + 1], table)):
+                            return ("%r doesn't do what %r does in %r"
+                                    % (other, representative, model.show(config)))
+                    continue
+                for number, (event_type, param) in enumerate(events):
+                    tried += 1
+                    if param == representative:
+                        param = other
+                    if after(swapped, event_type, param) != rename(children[number], table):
+                        return ("%r held in place of %r does something else in %r"
+                                % (other, representative, model.show(config)))
+    if stats is not None:
+        stats['configs'] = len(moves)
+        stats['events'] = tried
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--symmetric', action='store_true',
+                        help='use the keys of the code and a few others to '
+                             'stand for the rest, after checking every '
+                             'machine treats the rest alike (much faster)')
+    parser.add_argument('--alphabet', default=string.digits,
+                        help='the keys to try, besides the keys of the codes')
+    args = parser.parse_args()
+
+    from benchmark import load_statemachine
+    from lockout import LockoutBoard, LockoutStateMachine
+    from multicode import CodeIndex, MultiCodeMachine
+    from specmachine import GeneratedStateMachine
+    from statemachine import CompactStateMachine, HashedStateMachine, StateMachine
+
+    #Every check is (reference, candidate, codes, how many keys a
+    #configuration holds at most).
+    reference = statemachine_model(load_statemachine('iter2'), 'iter2 StateMachine')
+    #Allowed more wrong codes than a 2 byte counter can count, it never locks.
+    never = LockoutBoard(1, attempts=1 << 20)
+    candidates = [
+        statemachine_model(StateMachine),
+        statemachine_model(CompactStateMachine),
+        statemachine_model(HashedStateMachine),
+        statemachine_model(GeneratedStateMachine),
+        statemachine_model(lambda: LockoutStateMachine(never), 'LockoutStateMachine'),
+        ]
+    try:
+        candidates.append(lockbank_model())
+    except ImportError:
+        print("NumPy is not installed, skipping LockBank")
+    checks = [(reference, candidate, ['1234'], 4) for candidate in candidates]
+    checks.append((statemachine_model(StateMachine, digits=False),
+                   codemachine_model(CodeMachine), ['1234'], 4))
+
+    #8 digit codes, where there is no StateMachine to compare with. One
+    #code against CodeMachine, and a thousand against PrefixMachine, which
+    #has a configuration for the start of every code.
+    code = 'K7Q2Z9A4'
+    checks.append((codemachine_model(lambda: CodeMachine(code), '8 digit CodeMachine'),
+                   multicode_model(lambda: MultiCodeMachine(CodeIndex([code])),
+                                   '8 digit MultiCodeMachine', users=False),
+                   [code], 0))
+    rng = random.Random(5)
+    keypad = string.digits + string.ascii_uppercase
+    codes = dict(('user%d' % user, ''.join(rng.choice(keypad) for _ in code))
+                 for user in range(1000))
+    index = CodeIndex(codes)
+    checks.append((prefix_model(codes, '1000 8 digit codes'),
+                   multicode_model(lambda: MultiCodeMachine(index),
+                                   '1000 code MultiCodeMachine'),
+                   list(codes.values()), 0))
+
+    #And one that is wrong on purpose, to show the checker notices.
+    class Swapped(CompactStateMachine):
+        __slots__ = ()
+        def __init__(self):
+            CompactStateMachine.__init__(self)
+            self._correct = b'1243'
+    checks.append((reference, statemachine_model(Swapped, 'wrong on purpose'),
+                   ['1234'], 4))
+
+    failed = False
+    symmetric = {}
+    for reference, candidate, codes, hold in checks:
+        started = time.time()
+        keys = sorted(set(args.alphabet).union(*codes))
+        if args.symmetric:
+            keys, representatives, others = symmetric_keys(codes, keys, hold)
+            problem = None
+            for model in (reference, candidate):
+                #The same reference is used by most checks.
+                if (model, tuple(keys)) not in symmetric:
+                    symmetric[model, tuple(keys)] = check_symmetry(
+                        model, keys, representatives, others)
+                problem = problem or symmetric[model, tuple(keys)]
+            if problem is not None:
+                print("%-26s can't use --symmetric: %s" % (candidate.name, problem))
+                failed = True
+                continue
+        stats = {}
+        counterexample = check(reference, candidate, keys, stats)
+        if counterexample is None:
+            print("%-26s same as %s: %d configurations, %d events, %d keys, %.1fs"
+                  % (candidate.name, reference.name, stats['configs'],
+                     stats['events'], len(keys), time.time() - started))
+        else:
+            print("%-26s DIFFERENT from %s %s"
+                  % (candidate.name, reference.name, counterexample))
+            failed = failed or candidate.name != 'wrong on purpose'
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from codemachine import CodeMachine
+
+class CodeIndex(object):
+    """All of a lock's valid codes, stored as a trie.
+
+    A trie is a tree of dictionaries where each level is one key of the
+    code. For the codes 1234 and 1299 it looks like
+        {'1': {'2': {'3': {'4': 'alice'},
+                     '9': {'9': 'bob'}}}}
+    Following one key at a time from the top either ends at the user the
+    code belongs to, or falls off the tree as soon as the keys so far aren't
+    the start of any code. Each step is one dictionary lookup, so checking a
+    code takes the same time for 10 codes as for a million.
+
+    codes is a dictionary of user -> code. A plain list of codes works too,
+    and then each code is its own user. All codes must be the same length,
+    because the lock decides a code is finished by counting keys."""
+    def __init__(self, codes):
+        if not isinstance(codes, dict):
+            codes = dict((code, code) for code in codes)
+        if not codes:
+            raise ValueError("there has to be at least one code")
+
+        self.root = {}
+        self.code_length = None
+        for user, code in codes.items():
+            if self.code_length is None:
+                self.code_length = len(code)
+            if len(code) != self.code_length or not code:
+                raise ValueError("all codes have to be the same length")
+            node = self.root
+            for key in code[:-1]:
+                node = node.setdefault(key, {})
+            if code[-1] in node:
+                raise ValueError("two users have the code %r" % (code,))
+            node[code[-1]] = user
+        self.size = len(codes)
+
+    def __len__(self):
+        return self.size
+
+class MultiCodeMachine(CodeMachine):
+    """A CodeMachine that opens for any code in a CodeIndex, and remembers
+    whose code it was in user when it reaches CODEOK. One CodeIndex can be
+    shared by any number of machines.
+
+    Instead of a matching flag, the machine keeps its place in the trie. Once
+    the keys so far aren't the start of any code that place is None, and the
+    rest of the keys are just counted.
+
+    With reject_early the machine goes to CODEBAD as soon as that happens
+    instead of waiting for the last key. That is faster for the user, but
+    it also tells someone guessing exactly which key was wrong, so it is
+    off by default."""
+    def __init__(self, index, reject_early=False):
+        self._build_table()
+        self.index = index
+        self.code_length = index.code_length
+        self.reject_early = reject_early
+        self.alphabet = None
+        self._transition_IDLE()
+
+    def _transition_IDLE(self, keycode=None):
+        self.state = self.IDLE
+        self.count = 0
+        self.user = None
+        self._node = self.index.root
+
+    def _transition_ENTER(self, keycode):
+        node = self._node
+        if node is not None:
+            node = node.get(keycode)
+            self._node = node
+        self.count += 1
+        if self.count < self.code_length:
+            if node is None and self.reject_early:
+                self.state = self.CODEBAD
+            else:
+                self.state = self.ENTERING
+        elif node is None:
+            self.state = self.CODEBAD
+        else:
+            self.user = node
+            self.state = self.CODEOK
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
@@ -0,0 +1,257 @@
+"""Replays a log of key presses through StateMachines, using every core.
+
+The log is a text file with one key press per line:
+    lock_id timestamp key
+for example
+    17 1700000000.25 4
+Lines must be in timestamp order, like any log written as things happen.
+With --binary the log is in the format from eventlog.py instead, which is
+much faster to read.
+
+    python replay.py keys.log
+prints how many times each lock was opened or refused, and the state every
+lock finished in. To make a random log to try it on:
+    python replay.py --generate 1000000 --locks 5000 keys.log"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from statemachine import StateMachine
+from timerwheel import TimeoutDriver
+from eventlog import EventLogReader, EventLogWriter, read_binary_log
+
+class ReplayResult(object):
+    """What replaying (part of) a log found. codeok and codebad count how
+    many times any lock arrived at that state, final_states is lock_id ->
+    the state number it ended in."""
+    def __init__(self):
+        self.events = 0
+        self.codeok = 0
+        self.codebad = 0
+        self.final_states = {}
+
+    """Adds another ReplayResult into this one. Each shard has different
+    locks, so their final_states never overlap."""
+    def merge(self, other):
+        self.events += other.events
+        self.codeok += other.codeok
+        self.codebad += other.codebad
+        self.final_states.update(other.final_states)
+
+"""Yields (lock_id, timestamp, event_type, key) for every line, or with
+shards > 1 only for the lines whose lock_id % shards == shard. Text logs
+only hold key presses."""
+def read_log(path, shard=0, shards=1):
+    with open(path) as log:
+        for line in log:
+            lock_id, timestamp, key = line.split()
+            lock_id = int(lock_id)
+            if lock_id % shards == shard:
+                yield lock_id, float(timestamp), StateMachine.E_KEYPRESS, key
+
+"""read_log for several files, one after the other, as if they were one."""
+def read_logs(paths, shard=0, shards=1):
+    for path in paths:
+        yield from read_log(path, shard, shards)
+
+"""The timestamp of the last record of a log, or None if it is empty. A
+text log is read backwards from the end until its last line is found."""
+def log_end(path, binary=False, chunk=4096):
+    if binary:
+        with EventLogReader(path) as log:
+            last = log.last()
+        return None if last is None else last[1]
+    with open(path, 'rb') as log:
+        position = log.seek(0, 2)
+        tail = b''
+        while position:
+            step = min(chunk, position)
+            position -= step
+            log.seek(position)
+            tail = log.read(step) + tail
+            lines = tail.rstrip(b'\n').split(b'\n')
+            if len(lines) > 1 or not position:
+                return float(lines[-1].split()[1]) if lines[-1] else None
+    return None
+
+"""Part part of parts of a text log, split up by lock: every line whose
+lock_id % shards == shard is written to the file directory/part-shard.
+Returns the names of those files, one per shard.
+
+The part is a range of bytes of the file, so every part is read by only
+one process. A line belongs to the part it starts in. Only the lock_id of
+each line is looked at; reading the rest is left to replay_shard."""
+def split_log(path, part, parts, shards, directory, chunk=1 << 20):
+    size = os.path.getsize(path)
+    start = size * part // parts
+    end = size * (part + 1) // parts
+    names = [os.path.join(directory, '%d-%d' % (part, shard))
+             for shard in range(shards)]
+    outputs = [open(name, 'wb') for name in names]
+    try:
+        with open(path, 'rb') as log:
+            if start:
+                #The line going across start belongs to the part before.
+                log.seek(start - 1)
+                log.readline()
+            position = log.tell()
+            while position < end:
+                block = log.read(min(chunk, end - position))
+                if not block:
+                    break
+                #Finish the last line, even if it goes past end. If the
+                #block already ends with a whole line, the next line starts
+                #at end and belongs to the next part.
+                if not block.endswith(b'\n'):
+                    block += log.readline()
+                if not block.endswith(b'\n'):
+                    block += b'\n'
+                position = log.tell()
+                lines = [[] for _ in range(shards)]
+                for line in block.splitlines(True):
+                    lines[int(line[:line.index(b' ')]) % shards].append(line)
+                for output, shard_lines in zip(outputs, lines):
+                    output.writelines(shard_lines)
+    finally:
+        for output in outputs:
+            output.close()
+    return names
+
+"""Replays the records of the log whose lock_id % shards == shard. Each
+lock always lands in the same shard, so one process sees all of a lock's
+keys in the order they were pressed, which is all a lock needs to get the
+same answer as replaying the whole log in one process. records is the
+function that reads them, like read_log or eventlog.read_binary_log.
+
+Timeouts come from the timestamps in the log, through a TimeoutDriver, so a
+long gap between two keys clears a half typed code like it would have for
+real. The driver only moves forward when a record of this shard comes
+along, so end, the time the whole log finishes at, is where every shard
+stops. Timeouts up to then are fired before the final states are taken,
+so a lock ends up the same whichever locks share its shard."""
+def replay_shard(path, shard=0, shards=1, timeout=5.0, records=read_log,
+                 end=None):
+    result = ReplayResult()
+    driver = None
+    driver_machines = None
+    for lock_id, timestamp, event_type, key in records(path, shard, shards):
+        if driver is None:
+            driver = TimeoutDriver(timeout, now=timestamp)
+            driver_machines = driver.machines
+        machine = driver_machines.get(lock_id)
+        if machine is None:
+            machine = StateMachine()
+            driver.add(lock_id, machine)
+        old_state = machine.state
+        driver.do_event(lock_id, event_type, key, timestamp)
+
+        #Only count a lock arriving at CODEOK or CODEBAD. A timeout record
+        #for a lock that is already there leaves it there, and that isn't
+        #another code.
+        result.events += 1
+        state = machine.state
+        if state != old_state:
+            if state == StateMachine.CODEOK:
+                result.codeok += 1
+            elif state == StateMachine.CODEBAD:
+                result.codebad += 1
+
+    if driver is not None:
+        if end is not None:
+            driver.expire(end)
+        for lock_id, machine in driver_machines.items():
+            result.final_states[lock_id] = machine.state
+    return result
+
+"""Replays the log with one shard per worker process and adds the results
+back together. A worker's cost has to depend on its own shard only, not on
+the whole log, or adding workers stops helping long before the cores run
+out. So the log is only ever read in full once, split between all of them:
+
+A binary log is already cheap to look at. Every worker maps the file and
+NumPy picks out the worker's records, a whole chunk at a time, before any
+of them are unpacked (see eventlog.read_binary_log).
+
+A text log has to be split first. Each worker takes an equal range of
+bytes of the file and sorts its lines into one file per shard (split_log),
+and then each worker replays the files for its shard, in order. The first
+step only looks at lock ids, the second reads just the worker's own lines."""
+def replay(path, workers=None, timeout=5.0, binary=False):
+    workers = workers or os.cpu_count() or 1
+    records = read_binary_log if binary else read_log
+    end = log_end(path, binary)
+    if workers == 1:
+        return replay_shard(path, 0, 1, timeout, records, end)
+
+    result = ReplayResult()
+    directory = tempfile.mkdtemp()
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            if binary:
+                futures = [pool.submit(replay_shard, path, shard, workers,
+                                       timeout, records, end)
+                           for shard in range(workers)]
+            else:
+                splits = [pool.submit(split_log, path, part, workers, workers,
+                                      directory)
+                          for part in range(workers)]
+                parts = [split.result() for split in splits]
+                futures = [pool.submit(replay_shard,
+                                       [names[shard] for names in parts],
+                                       0, 1, timeout, read_logs, end)
+                           for shard in range(workers)]
+            for future in futures:
+                result.merge(future.result())
+    finally:
+        shutil.rmtree(directory)
+    return result
+
+def make_log(path, records, locks, seed=0, binary=False):
+    rng = random.Random(seed)
+    timestamp = 1700000000.0
+    if binary:
+        log = EventLogWriter(path, append=False)
+    else:
+        log = open(path, 'w')
+    with log:
+        for _ in range(records):
+            timestamp += rng.expovariate(locks / 2.0)
+            key = '1234'[rng.randrange(4)] if rng.random() < 0.5 else str(rng.randrange(10))
+            if binary:
+                log.write(rng.randrange(locks), timestamp,
+                          StateMachine.E_KEYPRESS, key)
+            else:
+                log.write("%d %.3f %s\n" % (rng.randrange(locks), timestamp, key))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--generate', type=int, metavar='RECORDS',
+                        help='write a random log with this many records')
+    parser.add_argument('--locks', type=int, default=1000)
+    parser.add_argument('--binary', action='store_true',
+                        help='the log is in the eventlog.py binary format')
+    args = parser.parse_args()
+
+    if args.generate:
+        make_log(args.log, args.generate, args.locks, binary=args.binary)
+        return
+
+    start = time.perf_counter()
+    result = replay(args.log, args.workers, args.timeout, args.binary)
+    elapsed = time.perf_counter() - start
+    print("%d events from %d locks in %.2fs (%.0f events/sec)"
+          % (result.events, len(result.final_states), elapsed,
+             result.events / elapsed))
+    print("CODEOK %d  CODEBAD %d" % (result.codeok, result.codebad))
+    for lock_id in sorted(result.final_states):
+        print("%d %s" % (lock_id, StateMachine.STATE_NAMES[result.final_states[lock_id]]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Runs lots of keypads at once from a single python process.
+
+Every connection (or asyncio queue) is one keypad with its own StateMachine.
+Each byte a client sends is one key, and for every event the server sends
+back a line with the name of the new state. Start it with
+    python server.py --port 8765
+or  python server.py --unix /tmp/combolock.sock
+and try it with
+    nc localhost 8765
+
+asyncio lets one thread wait on thousands of connections at the same time.
+read more at:
+https://docs.python.org/3/library/asyncio.html"""
+import argparse
+import asyncio
+
+from statemachine import StateMachine
+
+class Session(object):
+    """One keypad. The timeout works like TimeoutDriver in timerwheel.py,
+    but uses the event loop's own timer (loop.call_later) instead of a
+    TimerWheel, since asyncio is already keeping track of time for us.
+
+    on_change is called with the new state after every event, including
+    ones caused by a timeout."""
+    def __init__(self, timeout, on_change=None):
+        self.machine = StateMachine()
+        self.timeout = timeout
+        self.on_change = on_change
+        self._timer = None
+
+    def key(self, c):
+        self.machine.do_event(StateMachine.E_KEYPRESS, c)
+        self._rearm()
+        self._changed()
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _rearm(self):
+        self.close()
+        if self.machine.handles(StateMachine.E_TIMEOUT):
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.timeout, self._fire_timeout)
+
+    def _fire_timeout(self):
+        self._timer = None
+        self.machine.do_event(StateMachine.E_TIMEOUT, None)
+        self._rearm()
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.machine.state)
+
+"""Turns every state name into the bytes we send back ahead of time, so
+answering a key is just a list lookup."""
+STATE_LINES = [(name + '\n').encode('ascii') for name in StateMachine.STATE_NAMES]
+
+class SessionServer(object):
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.sessions = 0
+        self.active = 0
+
+    """Handles one socket connection. asyncio calls this for every client
+    that connects to a server started with start_server/start_unix_server."""
+    async def handle_stream(self, reader, writer):
+        session = self._open(lambda state: writer.write(STATE_LINES[state]))
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for key in data:
+                    c = chr(key)
+                    if c.isalnum():
+                        session.key(c)
+                #Lets the event loop pause us if the client isn't reading
+                #its answers fast enough.
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._close(session)
+            writer.close()
+
+    """The same as handle_stream but for keys (one character strings) that
+    arrive on an asyncio.Queue. Putting None on the queue ends the session.
+    Returns the session's StateMachine."""
+    async def handle_queue(self, queue, on_change=None):
+        session = self._open(on_change)
+        try:
+            while True:
+                c = await queue.get()
+                if c is None:
+                    break
+                if c.isalnum():
+                    session.key(c)
+        finally:
+            self._close(session)
+        return session.machine
+
+    def _open(self, on_change):
+        self.sessions += 1
+        self.active += 1
+        return Session(self.timeout, on_change)
+
+    def _close(self, session):
+        session.close()
+        self.active -= 1
+
+    async def serve(self, host=None, port=None, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_stream, path)
+        else:
+            server = await asyncio.start_server(self.handle_stream, host, port)
+        async with server:
+            await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this unix socket instead')
+    parser.add_argument('--timeout', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = SessionServer(args.timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Saving state machines into bytes and getting them back, so keypad
+sessions can be moved to another computer if this one has to stop.
+
+A machine is saved as one fixed size record:
+    state       1 byte
+    count       1 byte, how many digits have been entered
+    digits      4 bytes, the entered digits (unused ones are 0)
+    code        4 byte unsigned int, which correct code the machine uses
+Most machines share one of a few correct codes, so instead of saving the
+code with every machine, a CodeTable numbers the codes and a record only
+holds the number. The CodeTable has to go along with the snapshots.
+
+What the CodeTable holds is each machine's stored_code. For StateMachine
+and CompactStateMachine that is the code itself. A HashedStateMachine
+stores its salt and hash instead, so its code is never written anywhere.
+Every one of those has its own salt, so each takes its own entry.
+
+Every record is the same size, so any number of machines can be saved
+into one contiguous buffer, and record i is always at byte i * RECORD.size.
+
+For a LockBank the arrays already are contiguous buffers, so saving one is
+just copying its arrays out, as fast as memory can be copied."""
+import struct
+
+from statemachine import StateMachine
+
+RECORD = struct.Struct('<BB4sI')
+
+class CodeTable(object):
+    """Gives every different stored_code a number, starting at 0. Codes are
+    bytes."""
+    def __init__(self, codes=()):
+        self.codes = []
+        self._numbers = {}
+        for code in codes:
+            self.number(code)
+
+    """The number of code, giving it a new one if it hasn't been seen."""
+    def number(self, code):
+        key = bytes(code)
+        number = self._numbers.get(key)
+        if number is None:
+            number = self._numbers[key] = len(self.codes)
+            self.codes.append(key)
+        return number
+
+    def code(self, number):
+        return self.codes[number]
+
+"""Every machine these work for keeps its digits in CompactStateMachine's
+buffer, so they are copied straight from and into it, the same way
+controller.py does, instead of going through cur_code, which builds a list.
+A restored machine is exactly what was saved, so it isn't dirty."""
+def _pack(machine, codes, buffer, offset):
+    count = machine._count
+    RECORD.pack_into(buffer, offset, machine.state, count, machine._digits[:count],
+                     codes.number(machine.stored_code))
+
+def _unpack(cls, codes, state, count, digits, code):
+    if count > cls.CODE_LENGTH:
+        raise ValueError("a record can't have %d digits" % count)
+    machine = cls()
+    machine.state = state
+    machine._count = count
+    machine._digits[:] = digits
+    machine.stored_code = codes.code(code)
+    machine.dirty = False
+    return machine
+
+"""Saves one machine. Works for StateMachine, CompactStateMachine and
+HashedStateMachine."""
+def snapshot(machine, codes):
+    buffer = bytearray(RECORD.size)
+    _pack(machine, codes, buffer, 0)
+    return bytes(buffer)
+
+def restore(data, codes, cls=StateMachine):
+    return _unpack(cls, codes, *RECORD.unpack(data))
+
+"""Saves a list of machines into one buffer. The buffer is made at its full
+size first and each record is packed straight into its place, so nothing
+has to be joined together at the end."""
+def encode(machines, codes):
+    buffer = bytearray(RECORD.size * len(machines))
+    offset = 0
+    for machine in machines:
+        _pack(machine, codes, buffer, offset)
+        offset += RECORD.size
+    return buffer
+
+def decode(buffer, codes, cls=StateMachine):
+    return [_unpack(cls, codes, *record) for record in RECORD.iter_unpack(buffer)]
+
+class IncrementalSnapshot(object):
+    """Saves only the machines of a list that changed since the last delta.
+    A delta is
+        4 byte count, then for each changed machine:
+            4 byte index into the list, then its RECORD
+    Apply the deltas in order on top of a full decode to get back to the
+    newest state.
+
+    The machines say themselves whether they changed, with their dirty flag
+    (see CompactStateMachine), and delta clears it. So only the changed
+    machines are packed, and finding them is one look at a flag per
+    machine, like encode_bank(dirty_only=True) does for a LockBank. A new
+    machine starts out dirty. Anything that changes a machine without going
+    through its transitions or setters has to set dirty itself, and only
+    one IncrementalSnapshot should be taken of the same machines."""
+    def __init__(self, codes):
+        self.codes = codes
+
+    def delta(self, machines):
+        size = RECORD.size
+        dirty = [index for index, machine in enumerate(machines) if machine.dirty]
+        changed = bytearray(4 + (4 + size) * len(dirty))
+        struct.pack_into('<I', changed, 0, len(dirty))
+        offset = 4
+        for index in dirty:
+            machine = machines[index]
+            struct.pack_into('<I', changed, offset, index)
+            _pack(machine, self.codes, changed, offset + 4)
+            machine.dirty = False
+            offset += 4 + size
+        return changed
+
+"""Changes the machines in the list to what a delta says they became."""
+def apply_delta(delta, machines, codes, cls=StateMachine):
+    count, = struct.unpack_from('<I', delta, 0)
+    offset = 4
+    for _ in range(count):
+        index, = struct.unpack_from('<I', delta, offset)
+        machines[index] = _unpack(cls, codes, *RECORD.unpack_from(delta, offset + 4))
+        offset += 4 + RECORD.size
+
+"""Saves a LockBank: the lock count, then every state byte, then every
+row of digits. With dirty_only, only locks whose dirty flag is set are
+saved, together with their indexes, and the flags are cleared.
+correct_code isn't saved, since it is part of how the bank was set up."""
+def encode_bank(bank, dirty_only=False):
+    import numpy as np
+    if dirty_only:
+        index = np.flatnonzero(bank.dirty).astype('<u4')
+        header = struct.pack('<IB', len(index), 1)
+        data = (header + index.tobytes() + bank.state[index].tobytes() +
+                bank.digits[index].tobytes())
+    else:
+        header = struct.pack('<IB', len(bank), 0)
+        data = header + bank.state.tobytes() + bank.digits.tobytes()
+    bank.dirty[:] = False
+    return data
+
+"""Loads what encode_bank saved into bank. A full snapshot replaces every
+lock, a dirty_only one just the locks it holds."""
+def decode_bank(data, bank):
+    import numpy as np
+    count, partial = struct.unpack_from('<IB', data, 0)
+    offset = struct.calcsize('<IB')
+    width = bank.CODE_LENGTH
+    index = slice(None)
+    if partial:
+        index = np.frombuffer(data, '<u4', count, offset)
+        offset += 4 * count
+    elif count != len(bank):
+        raise ValueError("snapshot has %d locks, bank has %d" % (count, len(bank)))
+    bank.state[index] = np.frombuffer(data, np.int8, count, offset)
+    offset += count
+    bank.digits[index] = np.frombuffer(data, np.uint8, count * width,
+                                       offset).reshape(count, width)
+    bank.dirty[index] = False
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
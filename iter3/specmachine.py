@@ -0,0 +1,161 @@
+"""Builds state machine classes from a description of the machine instead of
+from hand written python.
+
+A spec is a dictionary:
+    name         the name of the class to make
+    states       state names, in order. The first is the initial state.
+    events       event names, in order
+    setup        lines of python run in __init__, after state is set
+    actions      action name -> a line of python. It can use self and
+                 param (the event_param given to do_event).
+    guards       guard name -> a python expression, like actions
+    transitions  a list of (state, event, guard, [actions], new state)
+
+For a (state, event) pair, the transitions are tried in the order they are
+listed and the first one whose guard is True (or whose guard is None) is
+taken. Guards are checked before any of that transition's actions run.
+Pairs with no transition do nothing, like in StateMachine.
+
+compile_spec turns a spec into python source code for the class, with one
+small function per (state, event) pair that has the guards and actions
+written right into it, and runs it. The source is saved in a cache folder
+under a name made from a hash of the spec, so the next time the same spec is
+compiled (usually the next time the program starts) the saved file is loaded
+instead of being generated again. Changing the spec in any way changes the
+hash, so an old file is never used for a new spec."""
+import hashlib
+import importlib.util
+import json
+import os
+
+"""Part of the hash, so bumping it throws away files made by an older
+version of the code generator."""
+GENERATOR_VERSION = 1
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '__speccache__')
+
+"""iter2's machine written as a spec. GeneratedStateMachine at the bottom of
+this file is compiled from it."""
+COMBOLOCK_SPEC = {
+    'name': 'GeneratedStateMachine',
+    'states': ['IDLE', 'ONEDIGIT', 'TWODIGIT', 'THREEDIGIT', 'CODEOK', 'CODEBAD'],
+    'events': ['E_TIMEOUT', 'E_KEYPRESS'],
+    'setup': [
+        "self.cur_code = []",
+        "self.correct_code = ['1', '2', '3', '4']",
+        ],
+    'actions': {
+        'push': "self.cur_code.append(param)",
+        'clear': "self.cur_code = []",
+        },
+    'guards': {
+        'correct': "self.cur_code + [param] == self.correct_code",
+        },
+    'transitions': [
+        ('IDLE', 'E_KEYPRESS', None, ['push'], 'ONEDIGIT'),
+
+        ('ONEDIGIT', 'E_KEYPRESS', None, ['push'], 'TWODIGIT'),
+        ('ONEDIGIT', 'E_TIMEOUT', None, ['clear'], 'IDLE'),
+
+        ('TWODIGIT', 'E_KEYPRESS', None, ['push'], 'THREEDIGIT'),
+        ('TWODIGIT', 'E_TIMEOUT', None, ['clear'], 'IDLE'),
+
+        ('THREEDIGIT', 'E_KEYPRESS', 'correct', ['push'], 'CODEOK'),
+        ('THREEDIGIT', 'E_KEYPRESS', None, ['push'], 'CODEBAD'),
+        ('THREEDIGIT', 'E_TIMEOUT', None, ['clear'], 'IDLE'),
+
+        ('CODEOK', 'E_KEYPRESS', None, ['clear'], 'IDLE'),
+
+        ('CODEBAD', 'E_KEYPRESS', None, ['clear'], 'IDLE'),
+        ],
+    }
+
+def spec_hash(spec):
+    text = json.dumps([GENERATOR_VERSION, spec], sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+"""Writes the python source for a spec. The class is built on
+BaseStateMachine, so it gets do_event, do_events and handles from there,
+and _table is filled in directly instead of by _build_table."""
+def generate_source(spec):
+    states = spec['states']
+    events = spec['events']
+    state_number = dict((name, i) for i, name in enumerate(states))
+    event_number = dict((name, i) for i, name in enumerate(events))
+
+    lines = [
+        "# Generated by specmachine.py from spec %s. Do not edit." % spec_hash(spec),
+        "from statemachine import BaseStateMachine",
+        "",
+        "class %s(BaseStateMachine):" % spec['name'],
+        "    STATE_NAMES = %r" % (list(states),),
+        ]
+    for i, name in enumerate(states):
+        lines.append("    %s = %d" % (name, i))
+    for i, name in enumerate(events):
+        lines.append("    %s = %d" % (name, i))
+    lines += [
+        "",
+        "    def __init__(self):",
+        "        self.state = %d" % 0,
+        ]
+    for line in spec.get('setup', []):
+        lines.append("        " + line)
+    lines.append("")
+
+    #Group the transitions by (state, event), keeping their order.
+    pairs = {}
+    for state, event, guard, actions, target in spec['transitions']:
+        pairs.setdefault((state, event), []).append((guard, actions, target))
+
+    table = [{} for _ in states]
+    for (state, event), choices in sorted(pairs.items()):
+        function = "_%s__%s" % (state, event)
+        table[state_number[state]][event_number[event]] = function
+        lines.append("def %s(self, param=None):" % function)
+        for guard, actions, target in choices:
+            indent = "    "
+            if guard is not None:
+                lines.append("    if %s:" % spec['guards'][guard])
+                indent = "        "
+            for action in actions:
+                lines.append(indent + spec['actions'][action])
+            lines.append(indent + "self.state = %d" % state_number[target])
+            lines.append(indent + "return")
+        lines.append("")
+
+    lines.append("%s._table = [" % spec['name'])
+    for row in table:
+        lines.append("    {%s}," % ", ".join(
+            "%d: %s" % (event, function) for event, function in sorted(row.items())))
+    lines.append("    ]")
+    return "\n".join(lines) + "\n"
+
+"""Returns the class described by spec, generating and caching its source
+if this spec hasn't been compiled before."""
+def compile_spec(spec, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, "%s_%s.py" % (spec['name'], spec_hash(spec)))
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        #Write to a temporary name and rename it, so another process
+        #starting at the same time never sees a half written file.
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, 'w') as source:
+            source.write(generate_source(spec))
+        os.replace(temporary, path)
+
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    module_spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return getattr(module, spec['name'])
+
+GeneratedStateMachine = compile_spec(COMBOLOCK_SPEC)
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
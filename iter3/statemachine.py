@@ -0,0 +1,336 @@
+import hashlib
+import os
+from array import array
+from hmac import compare_digest
+
+"""What do_event calls for a (state, event) pair that is not in the table."""
+def _no_transition(machine, keycode=None):
+    pass
+
+"""do_events accepts a few different kinds of event lists. This turns all of
+them into (event_type, event_param) pairs.
+  - Anything with named 'event_type' and 'param' fields, like a NumPy
+    structured array. param holds the key as a number, like getch returns.
+  - An array.array of numbers packed as event, key, event, key, ...
+  - Any other iterable of (event_type, event_param) pairs is used as is.
+The packed forms store keys as numbers, so they are turned back into the one
+character strings the rest of the state machine expects with chr.
+
+Each field of a structured array is copied into one bytes object, which
+takes one byte per event. Going through bytes gives back small ints and
+chr of those gives one character strings, and python keeps a single copy
+of every one of those ready, so no object is made per event."""
+def event_pairs(events):
+    names = getattr(getattr(events, 'dtype', None), 'names', None)
+    if names:
+        return zip(events['event_type'].astype('u1').tobytes(),
+                   map(chr, events['param'].astype('u1').tobytes()))
+    if isinstance(events, array):
+        return zip(events[0::2], map(chr, events[1::2]))
+    return events
+
+class BaseStateMachine(object):
+    """Everything about the machine that doesn't depend on how the entered
+    code is stored: the state numbers, the transition table and the
+    functions that use it. CompactStateMachine and StateMachine below build
+    on this, and so do CodeMachine and the machines specmachine.py makes.
+
+    __slots__ is explained in CompactStateMachine. It is empty here so this
+    class doesn't force a __dict__ onto classes built on it that don't want
+    one.
+
+    Same state numbers as iter2. Look there for the long explanation."""
+    __slots__ = ()
+
+    STATE_NAMES = [
+        'IDLE',
+        'ONEDIGIT',
+        'TWODIGIT',
+        'THREEDIGIT',
+        'CODEOK',
+        'CODEBAD',
+        ]
+
+    IDLE = 0
+    ONEDIGIT = 1
+    TWODIGIT = 2
+    THREEDIGIT = 3
+    CODEOK = 4
+    CODEBAD = 5
+
+    E_TIMEOUT = 0
+    E_KEYPRESS = 1
+
+    """This is the whole control logic of iter2's do_event written down as
+    data instead of as if statements. Each entry reads
+        (starting state, event): name of the transition function to call
+    Any (state, event) pair that is not listed does nothing, exactly like
+    falling off the end of the if/elif chain in iter2.
+
+    Only names are stored here. The real functions are looked up by
+    _build_table the first time the class is used, so a subclass that
+    overrides a _transition_ function gets its own version in its table."""
+    TRANSITIONS = {
+        (IDLE, E_KEYPRESS): '_transition_1DIGIT',
+
+        (ONEDIGIT, E_KEYPRESS): '_transition_2DIGIT',
+        (ONEDIGIT, E_TIMEOUT): '_transition_IDLE',
+
+        (TWODIGIT, E_KEYPRESS): '_transition_3DIGIT',
+        (TWODIGIT, E_TIMEOUT): '_transition_IDLE',
+
+        (THREEDIGIT, E_KEYPRESS): '_transition_GOODBAD',
+        (THREEDIGIT, E_TIMEOUT): '_transition_IDLE',
+
+        (CODEOK, E_KEYPRESS): '_transition_IDLE',
+
+        (CODEBAD, E_KEYPRESS): '_transition_IDLE',
+        }
+
+    """Turns TRANSITIONS into _table, a list with one entry per state. Each
+    entry is a small dictionary from event to the function that should run,
+    so the function for a state and event is just
+        _table[state][event]
+    This only does real work once per class. Every instance after the first
+    finds _table already sitting on its class and returns immediately."""
+    @classmethod
+    def _build_table(cls):
+        if '_table' in cls.__dict__:
+            return
+        table = [{} for _ in cls.STATE_NAMES]
+        for (state, event), name in cls.TRANSITIONS.items():
+            table[state][event] = getattr(cls, name)
+        cls._table = table
+
+    """do_event is now one lookup and one call, no matter which state we are
+    in. In iter2 being in CODEBAD meant failing five state comparisons before
+    finding the right branch. _no_transition is what we get for events the
+    current state doesn't care about.
+
+    Every transition function takes the keycode, even the ones that don't
+    use it, so do_event can call any of them the same way."""
+    def do_event(self, event_type, event_param):
+        self._table[self.state].get(event_type, _no_transition)(self, event_param)
+
+    """Tells you whether the current state does anything on event_type. For
+    example handles(E_TIMEOUT) is only True while part of a code has been
+    entered, which is how timerwheel.py knows when a timer is needed."""
+    def handles(self, event_type):
+        return event_type in self._table[self.state]
+
+    """Runs a whole list of events through the machine in one call. This is
+    the same as calling do_event in a loop, but the loop is in here where the
+    table lookups can be kept in local variables instead of being found again
+    for every event.
+
+    Returns the final state. If record_states is True it instead returns an
+    array with the state after each event, one byte per event."""
+    def do_events(self, events, record_states=False):
+        table = self._table
+        if record_states:
+            states = array('b')
+            append = states.append
+            for event_type, event_param in event_pairs(events):
+                table[self.state].get(event_type, _no_transition)(self, event_param)
+                append(self.state)
+            return states
+
+        for event_type, event_param in event_pairs(events):
+            table[self.state].get(event_type, _no_transition)(self, event_param)
+        return self.state
+
+class CompactStateMachine(BaseStateMachine):
+    """A state machine that uses as little memory as possible, for when there
+    are millions of them. StateMachine below is this with a __dict__.
+
+    Normally every instance gets its own dictionary, __dict__, to hold its
+    attributes, which costs far more memory than the attributes themselves.
+    Listing the attributes in __slots__ tells python to give each instance
+    exactly those spaces and no dictionary. The catch is that you can't add
+    any attribute that isn't in the list.
+
+    The entered code is a fixed 4 byte buffer plus a count of how many bytes
+    are used, so going back to IDLE sets the count to 0 instead of making a
+    new list. Because of that, keys have to be characters that fit in one
+    byte.
+
+    cur_code and correct_code can still be read as lists of one character
+    strings, like iter2's, but they are built when you ask for them. Only
+    the _transition functions fill the buffer, and snapshot.py, which
+    copies a saved one straight back into it, so cur_code can't be set.
+
+    dirty is set by every transition and by the setters below, whenever
+    the machine changes in a way snapshot.py would save. Whoever saves it
+    clears it (see snapshot.IncrementalSnapshot), the same as LockBank's
+    dirty array."""
+    __slots__ = ('state', '_digits', '_count', '_correct', 'dirty')
+
+    CODE_LENGTH = 4
+
+    def __init__(self):
+        self._build_table()
+        self._digits = bytearray(self.CODE_LENGTH)
+        self._transition_IDLE()
+        #Same code as iter2. Using a bytes literal means every
+        #instance shares this one object instead of each making its own.
+        self._correct = b'1234'
+
+    @property
+    def cur_code(self):
+        return [chr(key) for key in self._digits[:self._count]]
+
+    @property
+    def correct_code(self):
+        return [chr(key) for key in self._correct]
+
+    @correct_code.setter
+    def correct_code(self, code):
+        self._correct = bytes(bytearray(ord(key) for key in code))
+        self.dirty = True
+
+    """What snapshot.py saves to stand for the correct code, as bytes.
+    Here that is just the code. HashedStateMachine, which can't give its
+    code back, saves its salt and hash instead."""
+    @property
+    def stored_code(self):
+        return self._correct
+
+    @stored_code.setter
+    def stored_code(self, data):
+        self._correct = bytes(data)
+        self.dirty = True
+
+    def _transition_IDLE(self, keycode=None):
+        self.state = self.IDLE
+        self._count = 0
+        self.dirty = True
+
+    def _transition_1DIGIT(self, keycode):
+        self._digits[0] = ord(keycode)
+        self._count = 1
+        self.state = self.ONEDIGIT
+        self.dirty = True
+
+    def _transition_2DIGIT(self, keycode):
+        self._digits[1] = ord(keycode)
+        self._count = 2
+        self.state = self.TWODIGIT
+        self.dirty = True
+
+    def _transition_3DIGIT(self, keycode):
+        self._digits[2] = ord(keycode)
+        self._count = 3
+        self.state = self.THREEDIGIT
+        self.dirty = True
+
+    """== stops at the first byte that differs, so a wrong first digit is
+    answered a tiny bit sooner than a wrong last digit. Someone timing the
+    lock very carefully could use that to find the code one digit at a time.
+    compare_digest always looks at every byte, so it takes the same time
+    however wrong the code is. For a 4 byte code, measured by
+    benchmark.bench_compare, it costs about the same as == (both around
+    60-70ns, nearly all of it the call). That is only true because the code
+    is short: it looks at every byte one at a time, so for 4096 bytes it
+    takes about 4us where == takes well under 0.1us."""
+    def _transition_GOODBAD(self, keycode):
+        self._digits[3] = ord(keycode)
+        self._count = 4
+        self.dirty = True
+        if compare_digest(self._digits, self._correct):
+            self.state = self.CODEOK
+        else:
+            self.state = self.CODEBAD
+
+class StateMachine(CompactStateMachine):
+    """The machine ComboLock, the server and the rest use. It behaves like
+    iter2's, but keeps the entered code the way CompactStateMachine does: in
+    a 4 byte buffer made once, compared with compare_digest. So no list is
+    made on every reset and no key tells anyone how much of the code was
+    right (see CompactStateMachine._transition_GOODBAD).
+
+    It has no __slots__ of its own, so unlike CompactStateMachine it still
+    has a __dict__. That leaves room for the attributes a subclass like
+    LockoutStateMachine adds, and lets a Tracer change its class."""
+
+"""The hash HashedStateMachine keeps of code, with salt in front of it."""
+def hash_code(code, salt):
+    return hashlib.sha256(salt + bytes(bytearray(ord(key) for key in code))).digest()
+
+class HashedStateMachine(CompactStateMachine):
+    """A CompactStateMachine that doesn't keep the correct code at all, only
+    a hash of it. Anyone who gets to look at the machine's memory, or at a
+    copy of it saved somewhere, doesn't see the code.
+
+    The hash starts with a salt, random bytes that are different for every
+    machine, so two locks with the same code don't have the same hash.
+    Keep in mind a 4 digit code only has 10000 possibilities, so anyone
+    with the hash and the salt can still try them all. The hash only keeps
+    the code from being read straight out.
+
+    The salted start of the hash is worked out once, in _salted, and copied
+    for every code, so each code costs one short hash. That is only done
+    when the fourth digit arrives, so spread over the keys of a code it is
+    a fraction of the cost per key.
+
+    correct_code can be set, but not read back. A lock that was set up
+    from a stored hash can be made with
+        HashedStateMachine(code_hash=..., salt=...)
+    stored_code is the salt followed by the hash, so snapshot.py and
+    durable.py save those and never see the code."""
+    __slots__ = ('_salt', '_salted', '_hash')
+
+    def __init__(self, code_hash=None, salt=None):
+        CompactStateMachine.__init__(self)
+        self._correct = None
+        if salt is None:
+            salt = os.urandom(16)
+        self._set_salt(salt)
+        if code_hash is None:
+            code_hash = hash_code('1234', salt)
+        self._hash = code_hash
+
+    def _set_salt(self, salt):
+        self._salt = salt
+        self._salted = hashlib.sha256(salt)
+
+    @property
+    def correct_code(self):
+        raise AttributeError("HashedStateMachine only keeps a hash of the code")
+
+    @correct_code.setter
+    def correct_code(self, code):
+        digest = self._salted.copy()
+        digest.update(bytes(bytearray(ord(key) for key in code)))
+        self._hash = digest.digest()
+        self.dirty = True
+
+    @property
+    def stored_code(self):
+        return self._salt + self._hash
+
+    """The hash is always the last 32 bytes, and whatever is before it is
+    the salt."""
+    @stored_code.setter
+    def stored_code(self, data):
+        size = hashlib.sha256().digest_size
+        self._set_salt(bytes(data[:-size]))
+        self._hash = bytes(data[-size:])
+        self.dirty = True
+
+    def _transition_GOODBAD(self, keycode):
+        self._digits[3] = ord(keycode)
+        self._count = 4
+        self.dirty = True
+        digest = self._salted.copy()
+        digest.update(self._digits)
+        if compare_digest(digest.digest(), self._hash):
+            self.state = self.CODEOK
+        else:
+            self.state = self.CODEBAD
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
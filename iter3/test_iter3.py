@@ -0,0 +1,812 @@
+"""Checks that iter3's machines do what they should. benchmark.py only
+times them, this is where they are proven right.
+
+Run it from this directory:
+    python -m unittest test_iter3
+Every iteration compares against iter2's StateMachine, the plain one that
+is easy to read and check by hand. A fast machine that gives the wrong
+answer isn't worth anything."""
+import collections
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+#The iter3 modules import each other by their plain names, so this folder
+#has to be on the path even when the tests are started from somewhere else.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import load_statemachine, make_events
+from statemachine import StateMachine
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EVENTS = make_events(10000)
+
+"""The state and entered code after every event."""
+def trace(machine, events):
+    states = []
+    for event_type, event_param in events:
+        machine.do_event(event_type, event_param)
+        states.append((machine.state, list(machine.cur_code)))
+    return states
+
+class TestSameBehavior(unittest.TestCase):
+    """Every machine that is meant to be StateMachine made faster has to
+    end up in the same state with the same code after every event."""
+    def assertSameAsIter2(self, make_machine):
+        expected = trace(load_statemachine('iter2')(), EVENTS)
+        self.assertEqual(trace(make_machine(), EVENTS), expected)
+
+    def test_iterations(self):
+        for iteration in ['iter1', 'iter3']:
+            self.assertSameAsIter2(load_statemachine(iteration))
+
+    def test_compact(self):
+        from statemachine import CompactStateMachine
+        self.assertSameAsIter2(CompactStateMachine)
+
+    def test_hashed(self):
+        from statemachine import HashedStateMachine
+        self.assertSameAsIter2(HashedStateMachine)
+
+    def test_generated(self):
+        from specmachine import GeneratedStateMachine
+        self.assertSameAsIter2(GeneratedStateMachine)
+
+    def test_lockout_that_never_locks(self):
+        from lockout import LockoutBoard, LockoutStateMachine
+        never = LockoutBoard(1, attempts=len(EVENTS))
+        self.assertSameAsIter2(lambda: LockoutStateMachine(never))
+
+    def test_lockout_keeps_empty_board(self):
+        from lockout import LockoutBoard, LockoutStateMachine
+        board = LockoutBoard(0)
+        self.assertIs(LockoutStateMachine(board).board, board)
+        self.assertEqual(len(LockoutStateMachine().board), 1)
+
+    def test_do_events(self):
+        expected = [state for state, code in trace(StateMachine(), EVENTS)]
+        states = StateMachine().do_events(EVENTS, record_states=True)
+        self.assertEqual(list(states), expected)
+
+    """CodeMachine has one ENTERING state where StateMachine has ONEDIGIT,
+    TWODIGIT and THREEDIGIT, so its state is compared by name, and its
+    count against how many digits StateMachine has."""
+    def test_code_machine(self):
+        from codemachine import CodeMachine
+        machine = StateMachine()
+        code_machine = CodeMachine('1234')
+        for event_type, event_param in EVENTS:
+            machine.do_event(event_type, event_param)
+            code_machine.do_event(event_type, event_param)
+            name = machine.STATE_NAMES[machine.state]
+            if name.endswith('DIGIT'):
+                name = 'ENTERING'
+            self.assertEqual(code_machine.STATE_NAMES[code_machine.state], name)
+            self.assertEqual(code_machine.count, len(machine.cur_code))
+
+class TestMultiCode(unittest.TestCase):
+    def test_finds_user(self):
+        from multicode import CodeIndex, MultiCodeMachine
+        index = CodeIndex({'alice': '1234', 'bob': '1299'})
+        machine = MultiCodeMachine(index)
+        for key in '1299':
+            machine.do_event(StateMachine.E_KEYPRESS, key)
+        self.assertEqual(machine.state, machine.CODEOK)
+        self.assertEqual(machine.user, 'bob')
+
+    def test_unknown_code(self):
+        from multicode import CodeIndex, MultiCodeMachine
+        machine = MultiCodeMachine(CodeIndex({'alice': '1234', 'bob': '1299'}))
+        for count, key in enumerate('1239', 1):
+            machine.do_event(StateMachine.E_KEYPRESS, key)
+            self.assertEqual(machine.count, count)
+        self.assertEqual(machine.state, machine.CODEBAD)
+        self.assertIsNone(machine.user)
+
+    """With reject_early the first key that no code starts with is CODEBAD
+    straight away. Without it the lock waits for the whole code."""
+    def test_reject_early(self):
+        from multicode import CodeIndex, MultiCodeMachine
+        index = CodeIndex(['1234', '1299'])
+        for reject_early, states in ((True, ['ENTERING', 'CODEBAD']),
+                                     (False, ['ENTERING', 'ENTERING'])):
+            machine = MultiCodeMachine(index, reject_early)
+            seen = []
+            for key in '15':
+                machine.do_event(StateMachine.E_KEYPRESS, key)
+                seen.append(machine.STATE_NAMES[machine.state])
+            self.assertEqual(seen, states)
+            self.assertIsNone(machine.user)
+
+    def test_bad_index(self):
+        from multicode import CodeIndex
+        with self.assertRaises(ValueError):
+            CodeIndex(['1234', '12345'])
+        with self.assertRaises(ValueError):
+            CodeIndex({'alice': '1234', 'bob': '1234'})
+        with self.assertRaises(ValueError):
+            CodeIndex([])
+
+class TestLockout(unittest.TestCase):
+    """The machine's clock is self.now, so lockouts can be stepped
+    through without waiting."""
+    def setUp(self):
+        from lockout import LockoutBoard, LockoutStateMachine
+        self.now = 0.0
+        self.board = LockoutBoard(3, attempts=3, delay=1.0, max_delay=3.0)
+        self.machine = LockoutStateMachine(self.board, 1, lambda: self.now)
+
+    def type(self, keys):
+        for key in keys:
+            self.machine.do_event(StateMachine.E_KEYPRESS, key)
+        return self.machine.state
+
+    def test_locks_out_and_backs_off(self):
+        from lockout import LockoutStateMachine
+        LOCKEDOUT = LockoutStateMachine.LOCKEDOUT
+        for _ in range(2):
+            self.assertEqual(self.type('9999'), StateMachine.CODEBAD)
+            self.type('0')
+        self.assertEqual(self.type('9999'), LOCKEDOUT)
+        self.assertEqual(self.board.until[1], 1.0)
+
+        #Keys and timeouts do nothing until the lockout is over.
+        self.now = 0.5
+        self.assertEqual(self.type('1234'), LOCKEDOUT)
+        self.machine.do_event(StateMachine.E_TIMEOUT, None)
+        self.assertEqual(self.machine.state, LOCKEDOUT)
+        self.now = 1.0
+        self.assertEqual(self.type('1'), StateMachine.IDLE)
+
+        #Every wrong code after that doubles the lockout, up to max_delay.
+        for until in (3.0, 6.0, 9.0):
+            self.assertEqual(self.type('9999'), LOCKEDOUT)
+            self.assertEqual(self.board.until[1], until)
+            self.now = until
+            self.type('0')
+
+        #A right code starts the count over.
+        self.assertEqual(self.type('1234'), StateMachine.CODEOK)
+        self.assertEqual((self.board.failures[1], self.board.until[1]), (0, 0.0))
+        self.type('0')
+        self.assertEqual(self.type('9999'), StateMachine.CODEBAD)
+
+    def test_locked(self):
+        self.board.record_failure(0, 0.0)
+        for index in (1, 2):
+            for _ in range(3):
+                self.board.record_failure(index, 10.0 * index)
+        for now in (0.0, 10.5, 15.0, 20.5, 25.0):
+            expected = [index for index in range(3)
+                        if self.board.is_locked(index, now)]
+            self.assertEqual(self.board.locked(now), expected)
+            if numpy is not None:
+                self.assertEqual(list(numpy.flatnonzero(
+                    self.board.locked(now, numpy=True))), expected)
+        self.assertEqual(self.board.locked(10.5), [1, 2])
+        self.assertEqual(self.board.locked(15.0), [2])
+        self.assertEqual(self.board.locked(25.0), [])
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestLockBank(unittest.TestCase):
+    """Runs the same random events through a LockBank and through one
+    StateMachine per lock, and checks every lock agrees after every
+    column."""
+    def test_same_as_statemachines(self, locks=200, columns=500):
+        from lockbank import LockBank
+        rng = numpy.random.default_rng(1)
+        bank = LockBank(locks)
+        machines = [StateMachine() for _ in range(locks)]
+        for _ in range(columns):
+            event_types = (rng.random(locks) > 0.1).astype(numpy.int8)
+            params = rng.choice(numpy.frombuffer(b'12345', dtype=numpy.uint8), locks)
+            bank.apply(event_types, params)
+            for i, machine in enumerate(machines):
+                machine.do_event(int(event_types[i]), chr(params[i]))
+                self.assertEqual(bank.state[i], machine.state)
+                self.assertEqual(bank.cur_code(i), machine.cur_code)
+
+class TestController(unittest.TestCase):
+    """Sends the same events to a Controller's keypads and to one
+    StateMachine per keypad. Every keypad has to match its StateMachine
+    after every event, and the parent has to be told about exactly the
+    CODEOKs and CODEBADs the StateMachines reached."""
+    def test_same_as_statemachines(self, children=50):
+        from controller import E_CODEBAD, E_CODEOK, Controller
+
+        class Recorder(object):
+            def __init__(self):
+                self.events = []
+            def do_event(self, event_type, child_id):
+                self.events.append((event_type, child_id))
+
+        rng = random.Random(5)
+        parent = Recorder()
+        controller = Controller(parent, children)
+        machines = [StateMachine() for _ in range(children)]
+        expected = []
+        for event_type, event_param in EVENTS:
+            child_id = rng.randrange(children)
+            machine = machines[child_id]
+            old_state = machine.state
+            machine.do_event(event_type, event_param)
+            if machine.state != old_state and machine.state == machine.CODEOK:
+                expected.append((E_CODEOK, child_id))
+            elif machine.state != old_state and machine.state == machine.CODEBAD:
+                expected.append((E_CODEBAD, child_id))
+            controller.do_event(child_id, event_type, event_param)
+            self.assertEqual(controller.child(child_id),
+                             (machine.state, machine.cur_code))
+        self.assertEqual(parent.events, expected)
+
+    def test_door(self):
+        from controller import Controller, DoorMachine
+        door = DoorMachine()
+        controller = Controller(door, 2)
+        for key in '9999x9999x8888':
+            controller.do_event(1, StateMachine.E_KEYPRESS, key)
+        self.assertEqual(door.state, door.ALARM)
+        for key in '1234':
+            controller.do_event(0, StateMachine.E_KEYPRESS, key)
+        self.assertEqual(door.state, door.LOCKED)
+
+class TestTimerWheel(unittest.TestCase):
+    """Arms, cancels and advances a small wheel at random and checks it
+    against a plain dict of key -> the tick it should fire on. With 4 slots
+    and 2 levels the wheel only reaches 16 ticks ahead, so timers cascade
+    all the time and the ones further away than that have to be put back
+    and come around again."""
+    def test_same_as_dict(self, steps=5000):
+        from timerwheel import TimerWheel
+        rng = random.Random(6)
+        wheel = TimerWheel(tick=1.0, slots=4, levels=2)
+        deadlines = {}
+        now = 0
+        for _ in range(steps):
+            action = rng.random()
+            key = rng.randrange(30)
+            if action < 0.5:
+                delay = rng.choice([rng.randrange(1, 8), rng.randrange(1, 60)])
+                wheel.arm(key, delay)
+                deadlines[key] = now + delay
+            elif action < 0.6:
+                wheel.cancel(key)
+                deadlines.pop(key, None)
+            else:
+                now += rng.choice([0, 1, 2, rng.randrange(40)])
+                fired = wheel.advance(now)
+                expected = [key for key, tick in deadlines.items() if tick <= now]
+                self.assertEqual(sorted(fired), sorted(expected))
+                firing = [deadlines.pop(key) for key in fired]
+                self.assertEqual(firing, sorted(firing))
+            self.assertEqual(len(wheel), len(deadlines))
+            for key in range(30):
+                self.assertEqual(key in wheel, key in deadlines)
+
+    """A machine's timer is armed while its state handles E_TIMEOUT,
+    moved by every key and cancelled once it is back in IDLE."""
+    def test_timeout_driver(self):
+        from timerwheel import TimeoutDriver
+        driver = TimeoutDriver(timeout=5.0, now=0.0)
+        for key in 'ab':
+            driver.add(key, StateMachine())
+        self.assertEqual(len(driver.wheel), 0)
+        driver.do_event('a', StateMachine.E_KEYPRESS, '1', 1.0)
+        driver.do_event('a', StateMachine.E_KEYPRESS, '2', 4.0)
+        self.assertEqual(driver.expire(8.5), [])
+        self.assertEqual(driver.machines['a'].state, StateMachine.TWODIGIT)
+        self.assertEqual(driver.expire(9.0), ['a'])
+        self.assertEqual(driver.machines['a'].state, StateMachine.IDLE)
+        self.assertEqual(len(driver.wheel), 0)
+        self.assertEqual(driver.machines['b'].state, StateMachine.IDLE)
+
+class TestComboLock(unittest.TestCase):
+    """Typing a key may only redraw what it changed. The window's calls are
+    saved every time getch hands out a key, so the calls in between are the
+    ones one key caused. After the first frame none of them may erase the
+    window or draw the border, the terminal may only be updated once, and
+    there can't be more addstr calls than rows that changed."""
+    def test_draws_only_changes(self):
+        from combolock import ComboLock
+        from display import MemoryBackend
+        #A right code, a wrong one, and a key after each to go back to IDLE.
+        typed = []
+        for key in '12345' + '98765':
+            typed += [key, -1]
+        backend = MemoryBackend(typed)
+        window = backend.window
+        getch = window.getch
+        saved = []
+        def saving_getch():
+            key = getch()
+            if key != -1:
+                saved.append((collections.Counter(window.calls), list(window.rows)))
+            return key
+        window.getch = saving_getch
+        ComboLock(backend).run()
+
+        self.assertEqual(len(saved), len(typed) // 2 + 1)
+        for (before, old_rows), (after, new_rows) in zip(saved, saved[1:]):
+            calls = after - before
+            changed = sum(1 for old, new in zip(old_rows, new_rows) if old != new)
+            self.assertEqual(calls['erase'], 0)
+            self.assertEqual(calls['border'], 0)
+            self.assertEqual(calls['doupdate'], 1)
+            self.assertGreater(changed, 0)
+            self.assertLessEqual(calls['addstr'], changed)
+
+    """Every getch moves the clock one second forward, so the -1s after
+    '12' are somebody not typing for longer than TIMEOUT. The half typed
+    code has to be cleared, so '1234' after it is a right code and not
+    '12' + '12' = CODEBAD."""
+    def test_timeout_clears_code(self):
+        from combolock import ComboLock
+        from display import MemoryBackend
+        now = [0.0]
+        backend = MemoryBackend(['1', '2'] + [-1] * 7 + ['1', '2', '3', '4', -1])
+        window = backend.window
+        getch = window.getch
+        rows = []
+        def ticking_getch():
+            now[0] += 1.0
+            rows.append(window.rows[11])
+            return getch()
+        window.getch = ticking_getch
+        lock = ComboLock(backend, clock=lambda: now[0])
+        lock.run()
+        self.assertEqual([state for when, state in lock.results],
+                         [StateMachine.CODEOK])
+        #The screen went back to an empty code before anything was typed
+        #again.
+        shown = [row.strip('| ') for row, _ in itertools.groupby(rows)]
+        self.assertEqual(shown, ["Curr PIN:", "Curr PIN: 1 2", "Curr PIN:",
+                                 "Curr PIN: 1 2 3 4"])
+
+    """Arrow keys come from getch as 259 and up, and chr(259) is a letter.
+    They have to be ignored, not handed to a machine whose keys are bytes."""
+    def test_ignores_special_keys(self):
+        from combolock import ComboLock
+        from display import MemoryBackend
+        lock = ComboLock(MemoryBackend(['1', '2', 259, -1, '3', '4', -1]))
+        lock.run()
+        self.assertEqual([state for when, state in lock.results],
+                         [StateMachine.CODEOK])
+
+class TestServer(unittest.TestCase):
+    """With a tiny timeout, one key on a queue session has to be followed
+    by the event loop's timer taking it back to IDLE, and on_change has to
+    hear about both."""
+    def test_timeout(self):
+        import asyncio
+        from server import SessionServer
+
+        async def session():
+            server = SessionServer(timeout=0.01)
+            queue = asyncio.Queue()
+            changes = []
+            task = asyncio.ensure_future(server.handle_queue(queue, changes.append))
+            await queue.put('1')
+            await asyncio.sleep(0.2)
+            self.assertEqual(changes, [StateMachine.ONEDIGIT, StateMachine.IDLE])
+            await queue.put(None)
+            machine = await task
+            self.assertEqual((server.sessions, server.active), (1, 0))
+            return machine
+
+        self.assertEqual(asyncio.run(session()).state, StateMachine.IDLE)
+
+class TestSnapshot(unittest.TestCase):
+    """A delta only holds the machines events were sent to since the last
+    one, and applying the deltas to a copy ends up with the same machines."""
+    def test_delta_holds_changed_machines(self):
+        from snapshot import CodeTable, IncrementalSnapshot, apply_delta, decode, encode
+        codes = CodeTable()
+        machines = [StateMachine() for _ in range(100)]
+        incremental = IncrementalSnapshot(codes)
+        self.assertEqual(len(incremental.delta(machines)), 4 + 100 * 14)
+        copy = decode(encode(machines, codes), codes)
+        self.assertEqual(len(incremental.delta(machines)), 4)
+
+        rng = random.Random(7)
+        for event_type, event_param in EVENTS[:500]:
+            touched = set()
+            for _ in range(3):
+                index = rng.randrange(len(machines))
+                machines[index].do_event(event_type, event_param)
+                touched.add(index)
+            delta = incremental.delta(machines)
+            self.assertLessEqual(len(delta), 4 + len(touched) * 14)
+            apply_delta(delta, copy, codes)
+        self.assertEqual([(machine.state, machine.cur_code) for machine in copy],
+                         [(machine.state, machine.cur_code) for machine in machines])
+
+    """restore copies a record's digits straight into the machine's 4 byte
+    buffer, so a record saying it has more has to be refused, or the
+    buffer would quietly grow."""
+    def test_restore_refuses_long_code(self):
+        from snapshot import RECORD, CodeTable, restore
+        from statemachine import CompactStateMachine
+        codes = CodeTable([b'1234'])
+        for cls in (StateMachine, CompactStateMachine):
+            machine = restore(RECORD.pack(StateMachine.THREEDIGIT, 3, b'123', 0),
+                              codes, cls)
+            self.assertEqual(machine.cur_code, ['1', '2', '3'])
+            with self.assertRaises(ValueError):
+                restore(RECORD.pack(StateMachine.CODEBAD, 5, b'1234', 0), codes, cls)
+
+class TestTracer(unittest.TestCase):
+    """A machine can't be attached to two Tracers at once, detaching puts
+    it back to normal, and a Tracer doesn't keep its machines alive."""
+    def test_attach_and_detach(self):
+        import gc
+        import weakref
+        from tracing import Tracer
+        first, second = Tracer(), Tracer()
+        machine = StateMachine()
+        first.attach(machine)
+        first.attach(machine)
+        with self.assertRaises(ValueError):
+            second.attach(machine)
+        with self.assertRaises(ValueError):
+            second.detach(machine)
+        machine.do_event(StateMachine.E_KEYPRESS, '1')
+        self.assertEqual(first.counts, {(StateMachine.IDLE, StateMachine.E_KEYPRESS,
+                                         StateMachine.ONEDIGIT): 1})
+        first.detach(machine)
+        self.assertIs(type(machine), StateMachine)
+        machine.do_event(StateMachine.E_KEYPRESS, '2')
+        second.attach(machine)
+        machine.do_event(StateMachine.E_KEYPRESS, '3')
+        self.assertEqual(sum(first.counts.values()), 1)
+        self.assertEqual(sum(second.counts.values()), 1)
+
+        dropped = weakref.ref(machine)
+        del machine
+        gc.collect()
+        self.assertIsNone(dropped())
+
+    """The clock hands out the times below, one for attaching each machine
+    and one for every event after it. From those come the dwell buckets
+    (stays under 1us go in 0, otherwise under 2**n us in n), what listeners
+    are called with, and what export writes."""
+    def test_clock(self):
+        from tracing import Tracer, read_trace
+        IDLE, ONEDIGIT, TWODIGIT = (StateMachine.IDLE, StateMachine.ONEDIGIT,
+                                    StateMachine.TWODIGIT)
+        KEY, TIMEOUT = StateMachine.E_KEYPRESS, StateMachine.E_TIMEOUT
+        times = iter([0.0, 3e-6, 103e-6, 103.5e-6, 200e-6, 1000e-6, 1103e-6, 2000e-6])
+        tracer = Tracer(dwell_times=True, record=True, clock=lambda: next(times))
+        heard = []
+        tracer.add_listener(lambda *transition: heard.append(transition))
+        machine = StateMachine()
+        tracer.attach(machine)
+        machine.do_event(KEY, '1')
+        machine.do_event(KEY, '2')
+        machine.do_event(TIMEOUT, None)
+        #IDLE doesn't handle timeouts, so this stay in IDLE goes on.
+        machine.do_event(TIMEOUT, None)
+        other = StateMachine()
+        tracer.attach(other)
+        machine.do_event(KEY, '5')
+        other.do_event(KEY, '7')
+
+        expected = [(IDLE, KEY, ONEDIGIT, 3e-6),
+                    (ONEDIGIT, KEY, TWODIGIT, 103e-6),
+                    (TWODIGIT, TIMEOUT, IDLE, 103.5e-6),
+                    (IDLE, TIMEOUT, IDLE, 200e-6),
+                    (IDLE, KEY, ONEDIGIT, 1103e-6),
+                    (IDLE, KEY, ONEDIGIT, 2000e-6)]
+        self.assertEqual(heard, expected)
+        #3us, 100us, 0.5us, then 999.5us and 1000us.
+        self.assertEqual(tracer.dwell, {IDLE: {2: 1, 10: 2}, ONEDIGIT: {7: 1},
+                                        TWODIGIT: {0: 1}})
+
+        path = os.path.join(tempfile.mkdtemp(), 'trace.bin')
+        try:
+            tracer.export(path)
+            self.assertEqual(len(tracer.records), 0)
+            tracer.export(path)
+            numbers = [0, 0, 0, 0, 0, 1]
+            self.assertEqual(read_trace(path),
+                             [(number,) + transition
+                              for number, transition in zip(numbers, expected)])
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+class TestDurable(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def states(self, machines):
+        return dict((lock_id, (machine.state, list(machine.cur_code)))
+                    for lock_id, machine in machines.items())
+
+    """Pretends the program was killed after any byte of the log had been
+    written. A log is written a batch at a time, keeping what every lock
+    looked like after each batch. Then for every length the file could have
+    been cut off at, the start of the log is copied into a new directory and
+    recovered, and the locks have to match how they were after the last
+    whole batch. Then a few more events are added, to check the log still
+    works after the cut. The log starts after a checkpoint, and each cut is
+    tried again with garbage after it, and with a half written checkpoint
+    and an old log lying around."""
+    def test_crash_at_every_offset(self, locks=5, batch=7):
+        from durable import CHECKPOINT_NAME, DurableLocks, _wal_name
+        rng = random.Random(4)
+        events = [(rng.randrange(locks), event) for event in EVENTS[:1000]]
+        original = os.path.join(self.work, 'original')
+        durable = DurableLocks(original, group=batch, sync=False)
+        for lock_id, event in events[:100]:
+            durable.do_event(lock_id, *event)
+        durable.checkpoint()
+        #What the locks look like after each batch of the new log.
+        expected = [self.states(durable.machines)]
+        #A whole number of batches, so every batch is batch_bytes long.
+        for lock_id, event in events[100:100 + 42 * batch]:
+            durable.do_event(lock_id, *event)
+            if durable._count == 0:
+                expected.append(self.states(durable.machines))
+        durable.close()
+
+        wal = _wal_name(durable.generation)
+        with open(os.path.join(original, wal), 'rb') as log:
+            data = log.read()
+        with open(os.path.join(original, CHECKPOINT_NAME), 'rb') as checkpoint:
+            checkpoint_data = checkpoint.read()
+        batch_bytes = 8 + batch * 6
+        for cut in range(len(data) + 1):
+            for tail in (b'', bytes(rng.randrange(256) for _ in range(20))):
+                crashed = os.path.join(self.work, 'crashed')
+                shutil.rmtree(crashed, ignore_errors=True)
+                os.mkdir(crashed)
+                with open(os.path.join(crashed, CHECKPOINT_NAME), 'wb') as checkpoint:
+                    checkpoint.write(checkpoint_data)
+                with open(os.path.join(crashed, wal), 'wb') as log:
+                    log.write(data[:cut] + tail)
+                if tail:
+                    #As if it stopped while writing the next checkpoint,
+                    #or before removing the log the checkpoint replaced.
+                    for name in (CHECKPOINT_NAME + '.tmp',
+                                 _wal_name(durable.generation - 1)):
+                        with open(os.path.join(crashed, name), 'wb') as junk:
+                            junk.write(tail)
+                recovered = DurableLocks(crashed, group=batch, sync=False)
+                self.assertEqual(self.states(recovered.machines),
+                                 expected[cut // batch_bytes],
+                                 "recovery after %d bytes" % cut)
+                for lock_id, event in events[-20:]:
+                    recovered.do_event(lock_id, *event)
+                recovered.close()
+                again = DurableLocks(crashed, sync=False)
+                self.assertEqual(self.states(again.machines),
+                                 self.states(recovered.machines),
+                                 "log after recovering at %d bytes" % cut)
+                again.close()
+
+    """Restarting more often than every checkpoint_every events must still
+    end in a checkpoint, so the log can't grow forever."""
+    def test_checkpoint_across_restarts(self):
+        from durable import DurableLocks
+        for lock_id in range(5):
+            with DurableLocks(self.work, group=1, checkpoint_every=10,
+                              sync=False) as durable:
+                for key in '1234':
+                    durable.do_event(lock_id, StateMachine.E_KEYPRESS, key)
+        self.assertGreater(durable.generation, 0)
+        durable = DurableLocks(self.work, sync=False)
+        for lock_id in range(5):
+            self.assertEqual(durable.machine(lock_id).state, StateMachine.CODEOK)
+        durable.close()
+
+    """A HashedStateMachine is checkpointed with its salt and hash, and
+    still knows its code after a restart without it ever being saved."""
+    def test_hashed_machines(self):
+        from durable import CHECKPOINT_NAME, DurableLocks
+        from statemachine import HashedStateMachine
+        with DurableLocks(self.work, cls=HashedStateMachine, group=1,
+                          sync=False) as durable:
+            durable.set_code(0, '9876')
+            for key in '98':
+                durable.do_event(0, StateMachine.E_KEYPRESS, key)
+            durable.checkpoint()
+        with open(os.path.join(self.work, CHECKPOINT_NAME), 'rb') as checkpoint:
+            self.assertNotIn(b'9876', checkpoint.read())
+        with DurableLocks(self.work, cls=HashedStateMachine, sync=False) as durable:
+            for key in '76':
+                durable.do_event(0, StateMachine.E_KEYPRESS, key)
+            self.assertEqual(durable.machine(0).state, StateMachine.CODEOK)
+
+    """A code set with set_code has to come back after a crash before any
+    checkpoint, without the code itself being in the log. If the log is cut
+    inside the code's batch, the lock keeps the code it had."""
+    def test_code_change_before_checkpoint(self):
+        from durable import DurableLocks, _wal_name
+        from statemachine import CompactStateMachine, HashedStateMachine
+        for cls in (StateMachine, CompactStateMachine, HashedStateMachine):
+            directory = os.path.join(self.work, cls.__name__)
+            durable = DurableLocks(directory, cls=cls, group=1, sync=False)
+            durable.set_code(0, '9876')
+            for key in '987':
+                durable.do_event(0, StateMachine.E_KEYPRESS, key)
+            #No close and no checkpoint: the program stops right here.
+            durable._file.close()
+            wal = os.path.join(directory, _wal_name(durable.generation))
+            with open(wal, 'rb') as log:
+                data = log.read()
+            if cls is HashedStateMachine:
+                self.assertNotIn(b'9876', data)
+
+            recovered = DurableLocks(directory, cls=cls, sync=False)
+            self.assertEqual(recovered.do_event(0, StateMachine.E_KEYPRESS, '6'),
+                             StateMachine.CODEOK)
+            recovered.close()
+
+            with open(wal, 'wb') as log:
+                log.write(data[:10])
+            cut = DurableLocks(directory, cls=cls, sync=False)
+            for key in '1234':
+                cut.do_event(0, StateMachine.E_KEYPRESS, key)
+            self.assertEqual(cut.machine(0).state, StateMachine.CODEOK)
+            cut.close()
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    """A timeout record for a lock sitting in CODEOK leaves it in CODEOK,
+    which is not another right code."""
+    def test_counts_arriving_at_codeok(self):
+        from eventlog import EventLogWriter, read_binary_log
+        from replay import replay_shard
+        path = os.path.join(self.work, 'keys.bin')
+        with EventLogWriter(path) as log:
+            for number, key in enumerate('1234'):
+                log.write(7, number * 0.1, StateMachine.E_KEYPRESS, key)
+            log.write(7, 1.0, StateMachine.E_TIMEOUT)
+            log.write(7, 2.0, StateMachine.E_TIMEOUT)
+        result = replay_shard(path, records=read_binary_log)
+        self.assertEqual((result.events, result.codeok, result.codebad), (6, 1, 0))
+        self.assertEqual(result.final_states, {7: StateMachine.CODEOK})
+
+    """Split across workers, text and binary logs have to give the same
+    answer as replaying them in one process."""
+    def test_workers_agree(self):
+        from replay import make_log, replay
+        for binary in ([False, True] if numpy is not None else [False]):
+            path = os.path.join(self.work, 'keys.%d' % binary)
+            make_log(path, 20000, 50, binary=binary)
+            single = replay(path, 1, binary=binary)
+            split = replay(path, 3, binary=binary)
+            self.assertEqual(
+                (split.events, split.codeok, split.codebad, split.final_states),
+                (single.events, single.codeok, single.codebad, single.final_states))
+            self.assertEqual(single.events, 20000)
+
+    """Every line is 10 bytes, so the parts of the log start exactly at the
+    start of a line, and that line must only be replayed by its own part."""
+    def test_parts_start_on_a_line(self):
+        from replay import replay
+        path = os.path.join(self.work, 'keys.log')
+        with open(path, 'w') as log:
+            for number, key in enumerate('12399876'):
+                log.write("0 %05.2f %s\n" % (number * 0.1, key))
+        self.assertEqual(os.path.getsize(path), 80)
+        single = replay(path, 1)
+        self.assertEqual((single.events, single.final_states),
+                         (8, {0: StateMachine.THREEDIGIT}))
+        for workers in (2, 4):
+            split = replay(path, workers)
+            self.assertEqual((split.events, split.final_states),
+                             (single.events, single.final_states))
+
+    """Lock 0 types one key, and then only lock 1, which lands in another
+    shard, types for longer than the timeout. Lock 0 has to time out back
+    to IDLE however many workers there are."""
+    def test_timeout_after_shard_goes_quiet(self):
+        from eventlog import EventLogWriter
+        from replay import log_end, replay
+        text = os.path.join(self.work, 'keys.log')
+        binary = os.path.join(self.work, 'keys.bin')
+        with open(text, 'w') as log, EventLogWriter(binary) as binary_log:
+            for number in range(40):
+                lock_id, key = (0, '1') if number == 0 else (1, '5')
+                log.write("%d %.1f %s\n" % (lock_id, number * 0.2, key))
+                binary_log.write(lock_id, number * 0.2, StateMachine.E_KEYPRESS, key)
+        self.assertAlmostEqual(log_end(text), 7.8)
+        self.assertAlmostEqual(log_end(binary, binary=True), 7.8)
+        for path, is_binary in ([(text, False), (binary, True)]
+                                if numpy is not None else [(text, False)]):
+            for workers in (1, 2):
+                result = replay(path, workers, binary=is_binary)
+                self.assertEqual(result.final_states[0], StateMachine.IDLE)
+
+    def test_generate_replaces_log(self):
+        from eventlog import EventLogReader
+        from replay import make_log
+        path = os.path.join(self.work, 'keys.bin')
+        make_log(path, 100, 5, binary=True)
+        make_log(path, 100, 5, binary=True)
+        with EventLogReader(path) as log:
+            self.assertEqual(len(log), 100)
+
+    """replay_lock and replay_locks, with chunks smaller than the log, have
+    to end every lock where sending it its records one by one does."""
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_replay_lock_in_chunks(self):
+        from eventlog import read_binary_log, replay_lock, replay_locks
+        from replay import make_log
+        path = os.path.join(self.work, 'keys.bin')
+        make_log(path, 5000, 7, binary=True)
+        expected = dict((lock_id, StateMachine()) for lock_id in range(7))
+        states = []
+        for lock_id, timestamp, event_type, key in read_binary_log(path):
+            expected[lock_id].do_event(event_type, key)
+            if lock_id == 3:
+                states.append(expected[lock_id].state)
+
+        self.assertEqual(list(replay_lock(path, 3, record_states=True, chunk=333)),
+                         states)
+        machines = dict((lock_id, StateMachine()) for lock_id in range(7))
+        replay_locks(path, machines, chunk=333)
+        self.assertEqual(self.states(machines), self.states(expected))
+
+    def states(self, machines):
+        return dict((lock_id, (machine.state, machine.cur_code))
+                    for lock_id, machine in machines.items())
+
+class TestModelCheck(unittest.TestCase):
+    def setUp(self):
+        from modelcheck import statemachine_model
+        self.reference = statemachine_model(load_statemachine('iter2'))
+
+    def test_finds_wrong_code(self):
+        from modelcheck import check, statemachine_model
+        from statemachine import CompactStateMachine
+
+        class Swapped(CompactStateMachine):
+            __slots__ = ()
+            def __init__(self):
+                CompactStateMachine.__init__(self)
+                self._correct = b'1243'
+        self.assertIsNone(check(self.reference, statemachine_model(StateMachine),
+                                '0123456789'))
+        counterexample = check(self.reference, statemachine_model(Swapped),
+                               '0123456789')
+        self.assertEqual([param for event_type, param in counterexample.events],
+                         ['1', '2', '3', '4'])
+
+    """A machine that takes Z for 1 passes a check that only uses the
+    representatives, so --symmetric has to notice it first."""
+    def test_symmetry_finds_special_key(self):
+        from modelcheck import check, check_symmetry, statemachine_model, symmetric_keys
+        from statemachine import CompactStateMachine
+
+        class TakesZ(CompactStateMachine):
+            __slots__ = ()
+            def _transition_1DIGIT(self, keycode):
+                CompactStateMachine._transition_1DIGIT(
+                    self, '1' if keycode == 'Z' else keycode)
+        keys, representatives, others = symmetric_keys(
+            ['1234'], '0123456789XYZ', 4)
+        self.assertIn('Z', others)
+        self.assertIsNone(check(self.reference, statemachine_model(TakesZ), keys))
+        self.assertIsNone(check_symmetry(self.reference, keys, representatives, others))
+        self.assertIsNotNone(check_symmetry(statemachine_model(TakesZ), keys,
+                                            representatives, others))
+
+if __name__ == '__main__':
+    unittest.main()
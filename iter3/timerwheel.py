@@ -0,0 +1,155 @@
+import math
+
+class TimerWheel(object):
+    """A timer wheel keeps track of when a lot of things should time out
+    without ever sorting or searching through them.
+
+    Picture a clock face with one bucket per tick. Arming a timer drops its
+    key into the bucket for the tick it should fire on, and every tick we
+    empty out the bucket the hand is pointing at. Arming and cancelling are
+    a dictionary lookup and a set add/remove, no matter how many timers
+    there are.
+
+    One clock face with 256 buckets only reaches 256 ticks ahead, so there
+    are several faces (levels). Each bucket on level 1 covers a whole turn
+    of level 0, each bucket on level 2 a whole turn of level 1, and so on.
+    Far away timers start on a higher level. When the hand of a level gets
+    to their bucket, they are moved down to the level below, where they
+    land closer to their exact tick. This is called cascading.
+
+    Times are in seconds and are always passed in by the caller, usually
+    from time.monotonic(), so the wheel works the same way in a test as it
+    does in a real program."""
+    def __init__(self, tick=0.1, slots=256, levels=3, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self._levels = [[set() for _ in range(slots)] for _ in range(levels)]
+        #key -> (level, slot, tick it expires on)
+        self._timers = {}
+        self._current = int(now / tick)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    """Starts a timer for key that fires delay seconds from the last time
+    passed to advance. If key already has a timer, it is moved instead, so
+    re-arming on every keypress is just calling this again."""
+    def arm(self, key, delay):
+        self.cancel(key)
+        expires = self._current + max(1, int(math.ceil(delay / self.tick)))
+        self._place(key, expires)
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            self._levels[timer[0]][timer[1]].discard(key)
+
+    """Moves the wheel forward to now and returns a list of the keys whose
+    timers fired on the way, in the order they fired."""
+    def advance(self, now):
+        target = int(now / self.tick)
+        expired = []
+        while self._current < target:
+            #Nothing armed means nothing to fire, so jump straight there
+            #instead of stepping through every empty tick.
+            if not self._timers:
+                self._current = target
+                break
+            self._current += 1
+            self._cascade()
+
+            bucket = self._levels[0][self._current % self.slots]
+            if bucket:
+                self._levels[0][self._current % self.slots] = set()
+                for key in bucket:
+                    level, slot, expires = self._timers.pop(key)
+                    if expires <= self._current:
+                        expired.append(key)
+                    else:
+                        #Further away than the top level can reach. Put it
+                        #back and it will come around again.
+                        self._place(key, expires)
+        return expired
+
+    """Finds the level whose buckets are wide enough to hold a timer that
+    far away, and the bucket on that level it belongs in."""
+    def _place(self, key, expires):
+        ticks = expires - self._current
+        level = 0
+        span = self.slots
+        while ticks >= span and level < len(self._levels) - 1:
+            level += 1
+            span *= self.slots
+        slot = (expires // (span // self.slots)) % self.slots
+        self._levels[level][slot].add(key)
+        self._timers[key] = (level, slot, expires)
+
+    """Every time the hand of a level finishes a full turn, the next
+    bucket of the level above is emptied down into the lower levels."""
+    def _cascade(self):
+        width = 1
+        for level in range(1, len(self._levels)):
+            width *= self.slots
+            if self._current % width:
+                break
+            slot = (self._current // width) % self.slots
+            bucket = self._levels[level][slot]
+            if not bucket:
+                continue
+            self._levels[level][slot] = set()
+            for key in bucket:
+                self._place(key, self._timers[key][2])
+
+class TimeoutDriver(object):
+    """Connects a TimerWheel to any number of state machines. Every event
+    for a machine goes through do_event here instead of straight to the
+    machine. That way, after each event, the machine's timer is re-armed if
+    its new state has something to do on E_TIMEOUT (like ONEDIGIT) and
+    cancelled if it doesn't (like IDLE).
+
+    expire fires E_TIMEOUT into every machine whose timer has run out.
+    Both do_event and expire call it first, so timeouts that happened
+    before an event are always handled before the event itself."""
+    def __init__(self, timeout=5.0, tick=0.1, now=0.0):
+        self.timeout = timeout
+        self.wheel = TimerWheel(tick, now=now)
+        self.machines = {}
+
+    def add(self, key, machine):
+        self.machines[key] = machine
+        self._rearm(key, machine)
+
+    def remove(self, key):
+        self.wheel.cancel(key)
+        return self.machines.pop(key)
+
+    """Returns the keys of the machines that timed out."""
+    def expire(self, now):
+        expired = self.wheel.advance(now)
+        for key in expired:
+            machine = self.machines[key]
+            machine.do_event(machine.E_TIMEOUT, None)
+            self._rearm(key, machine)
+        return expired
+
+    def do_event(self, key, event_type, event_param, now):
+        self.expire(now)
+        machine = self.machines[key]
+        machine.do_event(event_type, event_param)
+        self._rearm(key, machine)
+
+    def _rearm(self, key, machine):
+        if machine.handles(machine.E_TIMEOUT):
+            self.wheel.arm(key, self.timeout)
+        else:
+            self.wheel.cancel(key)
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
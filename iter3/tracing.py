@@ -0,0 +1,163 @@
+"""Watching what state machines do, for debugging and profiling.
+
+A Tracer is attached to the machines you want to watch:
+    tracer = Tracer()
+    tracer.attach(machine)
+After that, every event the machine handles is counted as a transition
+(old state, event, new state), the time spent in each state can be added to
+a histogram, and any listeners are called with
+    (old_state, event_type, new_state, timestamp)
+
+Machines that have no Tracer attached run exactly the same code they always
+did. attach doesn't add an 'if tracing:' check to do_event. Instead it
+changes the machine's class to a subclass whose do_event does the tracing,
+and detach changes it back. That is also why this works for
+CompactStateMachine, which has no room for any extra attributes.
+
+A machine can only be attached to one Tracer at a time. The Tracer only
+remembers its machines by id, so dropping a machine without detaching it
+doesn't keep it alive. Only its number and timestamp are left behind.
+
+One thing to know: newer versions of python store the attributes of
+ordinary objects in a faster way that is given up for good when the
+object's class is changed. So a StateMachine that was traced and then
+detached stays a little slower than one that never was. Machines that
+were never attached, and slotted ones like CompactStateMachine, are not
+affected."""
+import math
+import struct
+import time
+from array import array
+
+from statemachine import event_pairs
+
+"""One record of a binary trace: machine number, old state, event, new
+state and timestamp. 15 bytes, little endian, no padding."""
+TRACE_RECORD = struct.Struct('<IBBBd')
+
+class Tracer(object):
+    """counts is (old_state, event_type, new_state) -> how many times it
+    happened.
+
+    With dwell_times, dwell[state] is a histogram of how long machines
+    stayed in that state before an event moved them out, where bucket n
+    counts stays of less than 2**n microseconds (and at least 2**(n-1)).
+
+    With record, every transition is also packed into a bytearray as
+    TRACE_RECORD, ready to be written out with export. Machines are
+    numbered in the order they were attached.
+
+    clock is where timestamps come from. It can be replaced to make traces
+    that are the same every run, for tests."""
+    def __init__(self, dwell_times=False, record=False, clock=time.perf_counter):
+        self.counts = {}
+        self.dwell = {}
+        self.listeners = []
+        self.dwell_times = dwell_times
+        self.record = record
+        self.records = bytearray()
+        self.clock = clock
+        self._classes = {}
+        self._machines = {}
+        self._attached = 0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    """Attaching a machine twice to the same Tracer does nothing. Attaching
+    one that another Tracer is watching is refused: its class would become
+    a traced class of a traced class, and detaching it from the first
+    Tracer would leave it with the second one's class still reporting to
+    the first."""
+    def attach(self, machine):
+        cls = type(machine)
+        tracer = getattr(cls, '_tracer', None)
+        if tracer is self:
+            return
+        if tracer is not None:
+            raise ValueError("the machine is attached to another Tracer")
+        if cls not in self._classes:
+            self._classes[cls] = self._traced_class(cls)
+        #The machine number, and when it entered its current state.
+        self._machines[id(machine)] = [self._attached, self.clock()]
+        self._attached += 1
+        machine.__class__ = self._classes[cls]
+
+    def detach(self, machine):
+        if getattr(type(machine), '_tracer', None) is not self:
+            raise ValueError("the machine isn't attached to this Tracer")
+        del self._machines[id(machine)]
+        machine.__class__ = type(machine).__bases__[0]
+
+    """Makes a subclass of cls whose do_event calls the real one and then
+    tells this Tracer what happened. do_events is replaced with a plain
+    loop over do_event so no event skips the tracing. __slots__ is empty,
+    so the subclass has exactly the same layout as cls, which python
+    requires before it lets a machine change class. _tracer is how attach
+    and detach tell whose class a machine has."""
+    def _traced_class(self, cls):
+        tracer = self
+        base_do_event = cls.do_event
+
+        def do_event(machine, event_type, event_param):
+            old_state = machine.state
+            base_do_event(machine, event_type, event_param)
+            tracer._transition(machine, old_state, event_type, machine.state)
+
+        def do_events(machine, events, record_states=False):
+            states = array('b')
+            for event_type, event_param in event_pairs(events):
+                do_event(machine, event_type, event_param)
+                if record_states:
+                    states.append(machine.state)
+            if record_states:
+                return states
+            return machine.state
+
+        return type('Traced' + cls.__name__, (cls,), {
+            '__slots__': (),
+            '_tracer': tracer,
+            'do_event': do_event,
+            'do_events': do_events,
+            })
+
+    def _transition(self, machine, old_state, event_type, new_state):
+        key = (old_state, event_type, new_state)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        timestamp = self.clock()
+        info = self._machines[id(machine)]
+        if self.dwell_times and old_state != new_state:
+            microseconds = (timestamp - info[1]) * 1e6
+            bucket = 0 if microseconds < 1 else int(math.log2(microseconds)) + 1
+            histogram = self.dwell.setdefault(old_state, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        if old_state != new_state:
+            info[1] = timestamp
+
+        if self.record:
+            self.records += TRACE_RECORD.pack(info[0], old_state, event_type,
+                                              new_state, timestamp)
+        for listener in self.listeners:
+            listener(old_state, event_type, new_state, timestamp)
+
+    """Writes the recorded trace to a file and clears it."""
+    def export(self, path):
+        with open(path, 'ab') as trace:
+            trace.write(self.records)
+        del self.records[:]
+
+"""Reads a file written by Tracer.export back as tuples of
+(machine number, old_state, event_type, new_state, timestamp)."""
+def read_trace(path):
+    with open(path, 'rb') as trace:
+        data = trace.read()
+    usable = len(data) - len(data) % TRACE_RECORD.size
+    return list(TRACE_RECORD.iter_unpack(data[:usable]))
+
+#This is simply prints an error if you run this file directly.
+#If you import the file, this code will not run.
+if __name__ == '__main__':
+    print("This file is just a library. To get the example running "
+          "run \n    python combolock.py\n"
+          "from this directory.")
@@ -0,0 +1,56 @@
+
+class ScreenView(object):
+    """Remembers what is on the screen, so drawing a new frame only has to
+    send the characters that changed.
+
+    A frame is a dictionary of row -> (column, text), one line of text per
+    row. draw compares each row of the new frame to what that row looked
+    like last time, and writes only the part from the first character that
+    changed to the last one. Rows that disappeared are covered with spaces.
+    The border is drawn once, since it never changes.
+
+    draw finishes with noutrefresh instead of refresh. That updates curses'
+    idea of what the screen should look like without sending anything to
+    the terminal yet. Whoever calls draw then calls curses.doupdate() once
+    for everything drawn since the last one."""
+    def __init__(self, win):
+        self.win = win
+        self._rows = {}
+        self._clean = False
+
+    """Forgets what is on the screen, so the next draw starts over by
+    erasing the window and drawing everything."""
+    def invalidate(self):
+        self._rows = {}
+        self._clean = False
+
+    def draw(self, frame):
+        if not self._clean:
+            self.win.erase()
+            self.win.border()
+            self._clean = True
+
+        rows = {}
+        for row, (column, text) in frame.items():
+            rows[row] = ' ' * column + text
+
+        for row in set(rows) | set(self._rows):
+            old = self._rows.get(row, '')
+            new = rows.get(row, '')
+            #Pad the shorter one with spaces, so old text that is longer
+            #than the new text gets covered up.
+            width = max(len(old), len(new))
+            old = old.ljust(width)
+            new = new.ljust(width)
+            if old == new:
+                continue
+            first = 0
+            while old[first] == new[first]:
+                first += 1
+            last = width - 1
+            while old[last] == new[last]:
+                last -= 1
+            self.win.addstr(row, first, new[first:last + 1])
+
+        self._rows = rows
+        self.win.noutrefresh()